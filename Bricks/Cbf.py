@@ -0,0 +1,144 @@
+"""
+Reader for CBF (Pilatus) images
+
+Same interface as the Qub readers: Cbf().readHandler(fd) returns an object
+with get() (the image as a numpy array) and info() (the header).
+The file is memory-mapped; uncompressed sections are returned as a view on
+the map, byte-offset compressed sections are decoded with numpy.
+"""
+import mmap
+import numpy
+
+BINARY_SECTION_START = b"\x0c\x1a\x04\xd5"
+
+ELEMENT_TYPES = { "signed 8-bit integer": numpy.int8,
+                  "unsigned 8-bit integer": numpy.uint8,
+                  "signed 16-bit integer": numpy.int16,
+                  "unsigned 16-bit integer": numpy.uint16,
+                  "signed 32-bit integer": numpy.int32,
+                  "unsigned 32-bit integer": numpy.uint32,
+                  "signed 32-bit real IEEE": numpy.float32,
+                  "signed 64-bit real IEEE": numpy.float64 }
+
+
+def _read_int(raw, offsets, nbytes):
+    # little endian signed integers of nbytes bytes starting at each offset
+    data = raw.view(numpy.uint8)
+    last = len(data) - 1
+    value = numpy.zeros(len(offsets), numpy.int64)
+    for i in range(nbytes):
+        value |= data[numpy.minimum(offsets + i, last)].astype(numpy.int64) << (8 * i)
+    if nbytes < 8:
+        sign = 1 << (8 * nbytes - 1)
+        value = numpy.where(value >= sign, value - 2 * sign, value)
+    return value
+
+
+def decompress_byte_offset(raw, nb_elements, dtype=numpy.int32):
+    """Decode CBF byte-offset compressed data (raw is a numpy int8 array)
+
+    Each value is stored as the difference with the previous one: one byte,
+    or 0x80 followed by 2 bytes, or 0x80 0x8000 followed by 4 bytes, or
+    0x80 0x8000 0x80000000 followed by 8 bytes.
+    """
+    escapes = numpy.flatnonzero(raw == -128)
+    if len(escapes) == 0:
+        return numpy.cumsum(raw[:nb_elements], dtype=numpy.int64).astype(dtype)
+
+    # decode every 0x80 byte as if it was an escape
+    values = _read_int(raw, escapes + 1, 2)
+    ends = escapes + 2
+    wide = values == -32768
+    if wide.any():
+        values[wide] = _read_int(raw, escapes[wide] + 3, 4)
+        ends[wide] = escapes[wide] + 6
+        wider = wide & (values == -2147483648)
+        if wider.any():
+            values[wider] = _read_int(raw, escapes[wider] + 7, 8)
+            ends[wider] = escapes[wider] + 14
+
+    # 0x80 bytes inside the payload of a previous escape are not escapes; this
+    # can only happen within 14 bytes of another 0x80, so only those are checked
+    real = numpy.ones(len(escapes), numpy.bool_)
+    escape_list = escapes.tolist()
+    end_list = ends.tolist()
+    covered_until = {}
+    for i in (numpy.flatnonzero(numpy.diff(escapes) <= 14) + 1).tolist():
+        if i - 1 in covered_until:
+            previous_end = covered_until[i - 1]
+        else:
+            previous_end = end_list[i - 1]
+        if escape_list[i] <= previous_end:
+            real[i] = False
+            covered_until[i] = previous_end
+    escapes = escapes[real]
+    values = values[real]
+    ends = ends[real]
+
+    deltas = raw.astype(numpy.int64)
+    deltas[escapes] = values
+    # drop the payload bytes
+    payload = numpy.bincount(escapes + 1, minlength=len(raw) + 1) - \
+              numpy.bincount(numpy.minimum(ends + 1, len(raw)), minlength=len(raw) + 1)
+    keep = numpy.cumsum(payload[:-1]) == 0
+    return numpy.cumsum(deltas[keep][:nb_elements]).astype(dtype)
+
+
+class CbfReadHandler:
+    def __init__(self, fd):
+        self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        start = self._map.find(BINARY_SECTION_START)
+        if start < 0:
+            raise ValueError("no binary section in CBF file")
+        self._header = {}
+        self._binary = {}
+        self._parse_header(self._map[:start].decode("latin-1"))
+        self._start = start + len(BINARY_SECTION_START)
+        self._data = None
+
+    def _parse_header(self, text):
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith("# "):
+                # Pilatus mini-header, "# Key value"
+                items = line[2:].split(None, 1)
+                if len(items) == 2:
+                    self._header[items[0].rstrip(":")] = items[1]
+            elif line.startswith("X-Binary-") or line.startswith("Content-"):
+                key, _, value = line.partition(":")
+                self._binary[key.strip()] = value.strip().strip('"')
+            elif line.startswith("conversions="):
+                self._binary["conversions"] = line.partition("=")[2].strip('"')
+        self._header.update(self._binary)
+
+    def _compression(self):
+        conversions = (self._binary.get("conversions", "") + self._binary.get("Content-Type", "")).upper()
+        if "BYTE_OFFSET" in conversions:
+            return "byte_offset"
+        if "CBF_" in conversions and not "CBF_NONE" in conversions:
+            raise ValueError("unsupported CBF compression: %s" % conversions)
+        return None
+
+    def get(self):
+        if self._data is None:
+            size = int(self._binary["X-Binary-Size"])
+            nb_elements = int(self._binary["X-Binary-Number-of-Elements"])
+            width = int(self._binary["X-Binary-Size-Fastest-Dimension"])
+            height = int(self._binary.get("X-Binary-Size-Second-Dimension", nb_elements // width))
+            dtype = ELEMENT_TYPES.get(self._binary.get("X-Binary-Element-Type"), numpy.int32)
+
+            if self._compression() == "byte_offset":
+                raw = numpy.frombuffer(self._map, numpy.int8, size, self._start)
+                data = decompress_byte_offset(raw, nb_elements, dtype)
+            else:
+                data = numpy.frombuffer(self._map, numpy.dtype(dtype).newbyteorder("<"), nb_elements, self._start)
+            self._data = data.reshape((height, width))
+        return self._data
+
+    def info(self):
+        return self._header
+
+
+class Cbf:
+    def readHandler(self, fd):
+        return CbfReadHandler(fd)
@@ -5,9 +5,13 @@ from BlissFramework.BaseComponents import BlissWidget
 from BlissFramework import Icons
 import logging
 import os,sys
+import numpy
+from collections import OrderedDict
+import image_statistics
 from Qub.Data.Source.QubADSC import QubADSC
 from Qub.Data.Source.QubMarCCD import QubMarCCD
 from Qub.CTools import pixmaptools
+from Cbf import Cbf
 
 try:
     from Bruker import Bruker
@@ -24,12 +28,72 @@ class DataCollectStatusGUIEvent(QCustomEvent):
         self.method = method
         self.arguments = arguments
 
+IMAGE_LOADED_EVENT = QEvent.User + 2
+class ImageLoadedEvent(QCustomEvent):
+    def __init__(self, key, image):
+        QCustomEvent.__init__(self, IMAGE_LOADED_EVENT)
+        self.key = key
+        self.image = image
+
+class LoadedImage:
+    def __init__(self, data_array, headers, statistics, pyramid):
+        self.dataArray = data_array
+        self.headers = headers
+        self.statistics = statistics
+        # pyramid[0] is the full frame, each level is half the size of the previous one
+        self.pyramid = pyramid
+
+def build_pyramid(data_array, size):
+    pyramid = [data_array]
+    level = data_array
+    while max(level.shape)//2 >= size and min(level.shape) >= 2:
+        h, w = level.shape[0]//2*2, level.shape[1]//2*2
+        # keep the brightest pixel of each 2x2 block, so spots stay visible
+        level = level[:h,:w].reshape(h//2,2,w//2,2).max(axis=3).max(axis=1)
+        pyramid.append(level)
+    return pyramid
+
+class ImageLoaderThread(QThread):
+    def __init__(self, receiver, key, filename, format_reader_class, thumbnail_size):
+        QThread.__init__(self)
+        self.receiver = receiver
+        self.key = key
+        self.filename = filename
+        self.formatReaderClass = format_reader_class
+        self.thumbnailSize = thumbnail_size
+
+    def run(self):
+        try:
+            fd = file(self.filename)
+            try:
+                read_handler = self.formatReaderClass().readHandler(fd)
+                data_array = read_handler.get()
+                try:
+                    img_headers=read_handler.info()
+                except:
+                    img_headers={}
+            finally:
+                fd.close()
+            try:
+                statistics = image_statistics.ImageStatistics(data_array)
+            except:
+                logging.getLogger().exception("DataCollectStatusBrick: could not compute statistics of %s", self.filename)
+                statistics = None
+            image = LoadedImage(data_array, img_headers, statistics, build_pyramid(data_array, self.thumbnailSize))
+        except:
+            image = None
+        self.postEvent(self.receiver, ImageLoadedEvent(self.key, image))
+
 class DetectorImage(QLabel):
     NO_IMAGE_FILE = "blank_thumbnail.jpeg"
     IMAGE_DELAY = 2500
     IMAGE_TIMEOUT = 1000
     TIMEOUT_RETRIES = 5
     THUMBNAIL_SIZE = 250
+    CACHE_SIZE = 4
+
+    # decoded frames by (filename, mtime), shared by all the detector images
+    imageCache = OrderedDict()
 
     def __init__(self,*args):
         QLabel.__init__(self,*args)
@@ -43,6 +107,9 @@ class DetectorImage(QLabel):
         QObject.connect(self.timeoutTimer,SIGNAL('timeout()'),self.rereadImage)
         self.retries=None
         self.dataArray = []
+        self.loadedImage = None
+        self.loadingKey = None
+        self.loaderThreads = []
 
     def clearImage(self):
         self.setPixmap(self.noImagePixmap)
@@ -66,50 +133,68 @@ class DetectorImage(QLabel):
             final_filename="_".join(template_prefix_list)
             full_filename=os.path.join(self.waitingImage[0],"%s%s" % (final_filename,template_ext))
 
-        format_reader=None
+        format_reader_class=None
         if template_ext==".img":
-            format_reader=QubADSC()
+            format_reader_class=QubADSC
         elif template_ext==".mccd":
-            format_reader=QubMarCCD()            
+            format_reader_class=QubMarCCD
         elif template_ext==".gfrm":
-            format_reader=Bruker()
+            format_reader_class=Bruker
+        elif template_ext==".cbf":
+            format_reader_class=Cbf
         
         
-        if format_reader is not None:
+        if format_reader_class is not None:
             try:
-                fd = file(full_filename)
-                read_handler = format_reader.readHandler(fd)
-                data_array = read_handler.get()
-                self.dataArray = data_array
-            except:
-                self.retries-=1
-                if self.retries>0:
-                    self.readRetry()
-                else:
-                    self.retries=None
-                    if self.wantedImage is None:
-                        self.clearImage()
-
-                    self.readFailed(full_filename)
+                key=(full_filename,os.stat(full_filename).st_mtime)
+            except OSError:
+                self.imageLoaded(full_filename,None)
+                return
+            try:
+                image=DetectorImage.imageCache.pop(key)
+            except KeyError:
+                self.loaderThreads=[t for t in self.loaderThreads if not t.finished()]
+                self.loadingKey=key
+                loader_thread=ImageLoaderThread(self,key,full_filename,format_reader_class,DetectorImage.THUMBNAIL_SIZE)
+                loader_thread.start()
+                self.loaderThreads.append(loader_thread)
+            else:
+                DetectorImage.imageCache[key]=image
+                self.imageLoaded(full_filename,image)
+        else:
+            self.readFailed(full_filename)
 
-                    self.waitingImage=None
-                    if self.wantedImage is not None:
-                        self.setImageUpdated(False)
+    def customEvent(self,event):
+        if event.type() == IMAGE_LOADED_EVENT and event.key == self.loadingKey:
+            self.loadingKey=None
+            if event.image is not None:
+                DetectorImage.imageCache[event.key]=event.image
+                while len(DetectorImage.imageCache)>DetectorImage.CACHE_SIZE:
+                    DetectorImage.imageCache.popitem(last=False)
+            self.imageLoaded(event.key[0],event.image)
+
+    def imageLoaded(self,full_filename,image):
+        if image is None:
+            self.retries-=1
+            if self.retries>0:
+                self.readRetry()
             else:
-                try:
-                    img_headers=read_handler.info()
-                except:
-                    img_headers={}
-                self.readSuccessful(full_filename,data_array,img_headers)
+                self.retries=None
+                if self.wantedImage is None:
+                    self.clearImage()
+
+                self.readFailed(full_filename)
+
                 self.waitingImage=None
                 if self.wantedImage is not None:
                     self.setImageUpdated(False)
-            try:
-                fd.close()
-            except:
-                pass
         else:
-            self.readFailed(full_filename)
+            self.loadedImage = image
+            self.dataArray = image.dataArray
+            self.readSuccessful(full_filename,image.dataArray,image.headers)
+            self.waitingImage=None
+            if self.wantedImage is not None:
+                self.setImageUpdated(False)
 
     def readRetry(self):
         self.delayTimer.start(DetectorImage.IMAGE_TIMEOUT,True)
@@ -118,8 +203,14 @@ class DetectorImage(QLabel):
         self.emit(PYSIGNAL("imageUpdated"),(filename,self.waitingImage[2],False))
 
     def readSuccessful(self,filename,data_array,image_headers):
+        thumbnail=self.loadedImage.pyramid[-1]
+        statistics=self.loadedImage.statistics
+        if statistics is not None:
+            # same contrast as the "90%" mode of the image analysis
+            max_val=numpy.asarray(statistics.contrast_90()[1]).astype(thumbnail.dtype)
+            thumbnail=numpy.minimum(thumbnail,max_val)
         palette = pixmaptools.LUT.Palette(pixmaptools.LUT.Palette.REVERSEGREY)
-        qimage,(minVal,maxVal) = pixmaptools.LUT.map_on_min_max_val(data_array,palette,pixmaptools.LUT.LOG)
+        qimage,(minVal,maxVal) = pixmaptools.LUT.map_on_min_max_val(thumbnail,palette,pixmaptools.LUT.LOG)
         qimage = qimage.scale(250,250,qimage.ScaleMin)
         #qimage = qimage.smoothScale(250,250,qimage.ScaleMin)
         self.setPixmap(QPixmap(qimage))
@@ -2,6 +2,8 @@ from qt import *
 from BlissFramework import BaseComponents
 import BlissFramework
 import logging
+import os
+from log_sink import LogSink
 
 __category__ = 'mxCuBE'
 
@@ -14,8 +16,8 @@ class EDNATextEdit(QTextEdit):
     QTextEdit.__init__(self, *args)
     self.setFont(QFont( "Courier", 10, QFont.Bold ))
     self.setSizePolicy(QSizePolicy.Expanding,QSizePolicy.Expanding)
-    self.setTextFormat(QTextEdit.PlainText)
     self.setReadOnly(True)
+    self.logSink = LogSink(self)
 
   def addMessage(self, msg):
     i = msg.find("Characterisation short summary:")
@@ -24,8 +26,8 @@ class EDNATextEdit(QTextEdit):
       if j >= 0:
         for l in msg[i:j].split('\n'):
           logging.info(l) 
-    self.append(msg)
-    self.scrollToBottom()
+    for line in msg.splitlines():
+      self.logSink.add(str(QStyleSheet.escape(line)), line)
     
     #self.emit(PYSIGNAL("widgetSynchronize"),(msg,)) 
 
@@ -39,6 +41,8 @@ class EDNALogBrick(BaseComponents.BlissWidget):
 
         self.addProperty('ednaConnection', 'string', '')
         self.addProperty('myTabLabel', 'string', '')
+        self.addProperty('maxLines', 'integer', LogSink.MAX_LINES)
+        self.addProperty('logDirectory', 'string', '')
 
         self.dnaObj=None
 
@@ -80,6 +84,10 @@ class EDNALogBrick(BaseComponents.BlissWidget):
         output_widget = self.ednaOutputs.get(output_file)
         if output_widget is None:
           output_widget = EDNATextEdit(self.ednaOutputBox)
+          output_widget.setMaxLogLines(self['maxLines'])
+          if self['logDirectory']:
+            log_filename = os.path.splitext(os.path.basename(output_file))[0] + ".log"
+            output_widget.logSink.setLogFilename(os.path.join(self['logDirectory'], log_filename))
           self.ednaOutputBox.addWidget(output_widget)
           self.ednaOutputList.insertItem(output_file)
           self.ednaOutputList.setSelected(len(self.ednaOutputs), True) 
@@ -100,7 +108,8 @@ class EDNALogBrick(BaseComponents.BlissWidget):
     def clearMessages(self):
         self.ednaOutputList.clear()
         for output_widget in self.ednaOutputs.itervalues():
-          output_widget.clear()
+          output_widget.logSink.clear()
+          output_widget.logSink.setLogFilename(None)
         self.ednaOutputs={}
 
     def tabSelected(self,tab_name):
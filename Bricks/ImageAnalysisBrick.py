@@ -27,6 +27,7 @@ class DetectorImage(DataCollectStatusBrick.DetectorImage):
         self.emit(PYSIGNAL("imageUpdated"),(filename,False))
     def readSuccessful(self,filename,data_array,image_headers):
         self.emit(PYSIGNAL("imageUpdated"),(filename,True,data_array,image_headers))
+        self.emit(PYSIGNAL("imageStatistics"),(filename,self.loadedImage.statistics))
 
 class ImageAnalysisBrick(BlissWidget):
     ZOOM_LEVELS = ( (0.25,"25%"), (0.5,"50%"), (1.0,"100%"),\
@@ -42,13 +43,13 @@ class ImageAnalysisBrick(BlissWidget):
         self.collectObj = None
 
         self.imageHeaders={}
-        self.image90Contrast=None
-        self.imageStdDevContrast=None
+        self.imageStatistics=None
         self.currentImage=None
 
         self.detectorImage=DetectorImage(None)
         QObject.connect(self.detectorImage, PYSIGNAL("clearImage"), self.clearImage)
         QObject.connect(self.detectorImage, PYSIGNAL("imageUpdated"), self.detectorImageUpdated)
+        QObject.connect(self.detectorImage, PYSIGNAL("imageStatistics"), self.imageStatisticsReady)
 
         filename_box=QHBox(self)
         box1=QVBox(filename_box)
@@ -302,40 +303,21 @@ class ImageAnalysisBrick(BlissWidget):
 
             elif button==1:
                 colormap.setColorMapType(pixmaptools.LUT.Palette.REVERSEGREY)
-                colormap.setAutoscale(False)
-                try:
-                    min_val=float(self.image90Contrast[0])
-                    max_val=float(self.image90Contrast[1])
-                except:
-                    datatmp = self.imageDisplay.getData().copy()
-                    datatmp = datatmp.ravel()
-                    datatmp.sort()
-                    cumsum = datatmp.cumsum()
-                    limit = cumsum[-1] * 0.97
-                    maskResult = cumsum > limit
-                    max_val = datatmp[maskResult][0]
-                    min_val = self.imageDisplay.getData().min()
-                    self.image90Contrast=(min_val,max_val)
-                colormap.setMinMax(min_val,max_val)
+                if self.imageStatistics is None:
+                    colormap.setAutoscale(True)
+                else:
+                    colormap.setAutoscale(False)
+                    min_val,max_val=self.imageStatistics.contrast_90()
+                    colormap.setMinMax(float(min_val),float(max_val))
 
             elif button==2:
                 colormap.setColorMapType(pixmaptools.LUT.Palette.GREYSCALE)
-                colormap.setAutoscale(False)
-                try:
-                    min_val=float(self.imageStdDevContrast[0])
-                    max_val=float(self.imageStdDevContrast[1])
-                except:
-                    datatmp = self.imageDisplay.getData()
-                    nbValue = 1
-                    for val in datatmp.shape:
-                        nbValue *= val
-                    integralVal = datatmp.sum() 
-                    average = integralVal / nbValue
-                    stdDeviation = datatmp.std()
-                    min_val=average - stdDeviation
-                    max_val=average + stdDeviation
-                    self.imageStdDevContrast=(min_val,max_val)
-                colormap.setMinMax(min_val,max_val)
+                if self.imageStatistics is None:
+                    colormap.setAutoscale(True)
+                else:
+                    colormap.setAutoscale(False)
+                    min_val,max_val=self.imageStatistics.contrast_std_dev()
+                    colormap.setMinMax(float(min_val),float(max_val))
 
             self.imageDisplay.refresh()
 
@@ -346,8 +328,7 @@ class ImageAnalysisBrick(BlissWidget):
         #print "ImageAnalysisBrick.detectorImageUpdated",filename,status
         self.filenameBox.setEnabled(True)
 
-        self.image90Contrast=None
-        self.imageStdDevContrast=None
+        self.imageStatistics=None
         if status:
             self.imageFilename.setPaletteBackgroundColor(Qt.white)
             self.imageFilename.lineEdit().setPaletteBackgroundColor(Qt.white)
@@ -372,6 +353,11 @@ class ImageAnalysisBrick(BlissWidget):
             self.imageFilename.lineEdit().setPaletteBackgroundColor(Qt.red)
             self.lineSelection.setState(False)
 
+    def imageStatisticsReady(self,filename,statistics):
+        if filename==self.currentImage:
+            self.imageStatistics=statistics
+            self.contrastChanged(self.contrastBox.selectedId())
+
     def clearImage(self):
         #print "ImageAnalysisBrick.clearImage"
         self.currentImage=None
@@ -1,13 +1,18 @@
+import os
 import qt
 import logging
 
 from BlissFramework import BaseComponents
 from widgets.log_bar_widget import LogBarWidget
 from BlissFramework.Utils import GUILogHandler
+from log_sink import LogSink
 
 __category__ = 'mxCuBE_v3'
 
 class LogBarBrick(BaseComponents.BlissWidget):
+    # the full user log is kept there unless logFile is set (empty: no file)
+    DEFAULT_LOG_FILE = os.path.join(os.path.expanduser("~"), "mxcube_user.log")
+
     COLORS = { logging.NOTSET: 'lightgrey', logging.DEBUG: 'darkgreen', 
                logging.INFO: 'darkblue', logging.WARNING: 'orange', 
                logging.ERROR: 'red', logging.CRITICAL: 'black' }
@@ -17,17 +22,32 @@ class LogBarBrick(BaseComponents.BlissWidget):
 
         # Layout
         self._status_bar_widget = LogBarWidget(self)
+        self._log_sink = LogSink(self._status_bar_widget.text_edit,
+                                 log_filename=LogBarBrick.DEFAULT_LOG_FILE)
         main_layout = qt.QHBoxLayout(self)
         main_layout.addWidget(self._status_bar_widget)
 
         self.setSizePolicy(qt.QSizePolicy.MinimumExpanding, 
                            qt.QSizePolicy.Fixed)
 
+        self.addProperty('maxLines', 'integer', LogSink.MAX_LINES)
+        self.addProperty('logFile', 'string', LogBarBrick.DEFAULT_LOG_FILE)
+
         GUILogHandler.GUILogHandler().register(self)
         logger = logging.getLogger("user_level_log")
         logger.info('Ready')
 
 
+    def propertyChanged(self, property_name, old_value, new_value):
+        if property_name == 'maxLines':
+            self._status_bar_widget.text_edit.setMaxLogLines(new_value)
+        elif property_name == 'logFile':
+            self._log_sink.setLogFilename(new_value)
+        else:
+            BaseComponents.BlissWidget.propertyChanged(self, property_name,
+                                                       old_value, new_value)
+
+
     def customEvent(self, event):
         if self.isRunning():
             self.append_log_record(event.record)
@@ -40,9 +60,9 @@ class LogBarBrick(BaseComponents.BlissWidget):
             color = LogBarBrick.COLORS[level]
             date_time = "%s %s" % (record.getDate(), record.getTime())
 
-            self._status_bar_widget.text_edit.\
-                append("[<font color=%s>%s]</font>" % (color, date_time) + \
-                           " "*5 + "%s" % msg)
+            self._log_sink.add("[<font color=%s>%s]</font>" % (color, date_time) + \
+                                   " "*5 + "%s" % msg,
+                               "[%s] %s" % (date_time, msg))
 
 
     appendLogRecord = append_log_record
@@ -65,6 +65,7 @@ from matplotlib.backends.backend_agg import FigureCanvasAgg
 import os
 import numpy
 import shutil
+import file_numbering
 
 __category__ = 'mxCuBE'
 
@@ -361,12 +362,7 @@ class XfeSpectrumBrick(BlissWidget):
         
         filename_pattern = os.path.join(str(self.directoryInput.text()), "%s_%s_%%02d" % (str(self.prefixInput.text()),time.strftime("%d_%b_%Y")) )
         filename_pattern = os.path.extsep.join((filename_pattern, "png"))
-        filename = filename_pattern % 1
-
-        i = 2
-        while os.path.isfile(filename):
-            filename = filename_pattern % i
-            i=i+1
+        filename = file_numbering.reserve_filename(filename_pattern)[1]
         try:
             a=float(calib[0])
             b=float(calib[1])
@@ -396,7 +392,11 @@ class XfeSpectrumBrick(BlissWidget):
         ax.set_ylabel("Counts")
         canvas=FigureCanvasAgg(fig)
         logging.getLogger().info("Rendering spectrum to PNG file : %s", filename)
-        canvas.print_figure(filename, dpi=80)
+        try:
+            canvas.print_figure(filename, dpi=80)
+        except:
+            file_numbering.release_filename(filename)
+            raise
         logging.getLogger().debug("Copying PNG file to: %s", a_dir)
         shutil.copy (filename, a_dir)
         logging.getLogger().debug("Copying .fit file to: %s", a_dir)
@@ -0,0 +1,59 @@
+"""
+Statistics of a detector frame, for display contrast
+
+The frame is histogrammed once (exactly, one bin per value, for integer
+data with a reasonable range; with fixed-width bins otherwise), and contrast
+levels, percentiles, min/max, mean/std and the saturated pixel count are
+read from the histogram.
+"""
+import numpy
+
+class ImageStatistics:
+    NBINS = 65536
+    MAX_EXACT_RANGE = 1 << 20
+
+    def __init__(self, data, saturation=None, nbins=NBINS):
+        data = numpy.asarray(data).ravel()
+
+        self.size = data.size
+        self.min = data.min().item()
+        self.max = data.max().item()
+        self.mean = data.mean()
+        self.std = data.std()
+
+        if saturation is None and data.dtype.kind in "iu":
+            saturation = numpy.iinfo(data.dtype).max
+        if saturation is None:
+            self.saturated = 0
+        else:
+            self.saturated = int(numpy.count_nonzero(data >= saturation))
+
+        if data.dtype.kind in "iu" and self.max - self.min < ImageStatistics.MAX_EXACT_RANGE:
+            self.counts = numpy.bincount(numpy.subtract(data, self.min, dtype=numpy.intp))
+            self.values = numpy.arange(self.min, self.max + 1, dtype=numpy.float64)
+        else:
+            self.counts, edges = numpy.histogram(data, bins=nbins, range=(float(self.min), float(self.max)))
+            self.values = edges[:-1]
+        self._cumulative_counts = self.counts.cumsum()
+        self._cumulative_intensity = (self.counts * self.values).cumsum()
+
+    def _level(self, cumulative, limit):
+        above = numpy.flatnonzero(cumulative > limit)
+        if len(above) == 0:
+            return self.max
+        return self.values[above[0]]
+
+    def percentile(self, p):
+        """Value below which p percent of the pixels are"""
+        return self._level(self._cumulative_counts, self.size * p / 100.0)
+
+    def intensity_level(self, fraction):
+        """First value at which the cumulated intensity exceeds fraction of the total"""
+        return self._level(self._cumulative_intensity, self._cumulative_intensity[-1] * fraction)
+
+    def contrast_90(self):
+        return (self.min, self.intensity_level(0.97))
+
+    def contrast_std_dev(self):
+        return (self.mean - self.std, self.mean + self.std)
+
@@ -0,0 +1,82 @@
+"""
+Batched display of log lines in a QTextEdit
+
+Lines are queued in a bounded buffer and appended to the text edit in one
+batch per flush interval, with a single repaint and scroll; the text edit
+keeps at most max_lines lines (LogText format). If a log file is given,
+every line is also written there (UTF-8 encoded), including lines dropped
+from the display when the buffer overflows.
+"""
+from qt import *
+import collections
+import logging
+
+class LogSink(QObject):
+    FLUSH_INTERVAL = 200
+    MAX_LINES = 2000
+    BUFFER_SIZE = 5000
+
+    def __init__(self, text_edit, max_lines=MAX_LINES, buffer_size=BUFFER_SIZE, log_filename=None, flush_interval=FLUSH_INTERVAL):
+        QObject.__init__(self, text_edit)
+
+        self.textEdit = text_edit
+        self.textEdit.setTextFormat(QTextEdit.LogText)
+        self.textEdit.setMaxLogLines(max_lines)
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.flushInterval = flush_interval
+        self.logFile = None
+        self.setLogFilename(log_filename)
+
+        self.flushTimer = QTimer(self)
+        QObject.connect(self.flushTimer, SIGNAL("timeout()"), self.flush)
+
+    def setLogFilename(self, log_filename):
+        if self.logFile is not None:
+            self.logFile.close()
+            self.logFile = None
+        if log_filename:
+            try:
+                self.logFile = open(log_filename, "a")
+            except IOError:
+                logging.getLogger().exception("LogSink: cannot open log file %s", log_filename)
+
+    def add(self, line, file_line=None):
+        """Queue line for display; file_line (default: line) goes to the log file"""
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(line)
+        if self.logFile is not None:
+            if file_line is None:
+                file_line = line
+            if isinstance(file_line, unicode):
+                file_line = file_line.encode("utf-8")
+            self.logFile.write(file_line + "\n")
+        if not self.flushTimer.isActive():
+            self.flushTimer.start(self.flushInterval, True)
+
+    def flush(self):
+        if self.logFile is not None:
+            self.logFile.flush()
+        if not self.buffer:
+            return
+
+        lines = list(self.buffer)
+        self.buffer.clear()
+        if self.dropped:
+            lines.insert(0, "[%d lines not displayed]" % self.dropped)
+            self.dropped = 0
+
+        self.textEdit.setUpdatesEnabled(False)
+        try:
+            for line in lines:
+                self.textEdit.append(line)
+        finally:
+            self.textEdit.setUpdatesEnabled(True)
+        self.textEdit.scrollToBottom()
+        self.textEdit.viewport().update()
+
+    def clear(self):
+        self.buffer.clear()
+        self.dropped = 0
+        self.textEdit.clear()
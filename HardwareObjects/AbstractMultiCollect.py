@@ -7,6 +7,7 @@ import errno
 import abc
 import collections
 import gevent
+import gevent.event
 import xmlrpclib
 from HardwareRepository.TaskUtils import *
 
@@ -56,6 +57,109 @@ BeamlineConfig = collections.namedtuple('BeamlineConfig',
                                          'input_files_server'])
 
 
+class AutoProcessingNotifier(object):
+    """
+    Sends auto processing requests to the processing server from a
+    background greenlet, over one persistent connection, so that a slow
+    server never delays the data collection.
+
+    An "image" request identical to the last pending one is not queued
+    again: the requests carry no frame number, so there is no progress
+    range to send. When more than <max_pending> requests wait to be sent, the
+    oldest "image" requests are dropped; other requests ("before",
+    "after", "end_multicollect", radiation damage) are never dropped.
+    """
+    def __init__(self, server, max_pending=100):
+        self.server = server
+        self.max_pending = max_pending
+        self._proxy = None
+        self._pending = collections.deque()
+        self._wakeup = gevent.event.Event()
+        self._closing = False
+        self._metrics = {"queued": 0, "coalesced": 0, "sent": 0,
+                         "failed": 0, "dropped": 0, "last_send_time": None}
+        self._task = gevent.spawn(self._run)
+
+
+    def notify(self, method, *args):
+        """
+        Queues the call <method>(*args) on the processing server
+        """
+        self._metrics["queued"] += 1
+
+        if self._is_image_event(method, args) and self._pending and \
+               self._pending[-1] == (method, args):
+            self._metrics["coalesced"] += 1
+            return
+
+        self._pending.append((method, args))
+        if len(self._pending) > self.max_pending:
+            for request in self._pending:
+                if self._is_image_event(*request):
+                    self._pending.remove(request)
+                    self._metrics["dropped"] += 1
+                    break
+        self._wakeup.set()
+
+
+    def _is_image_event(self, method, args):
+        return method == "startProcessing" and args[0] == "image"
+
+
+    def get_metrics(self):
+        """
+        :returns: delivery counters and the number of pending requests
+        :rtype: dict
+        """
+        metrics = dict(self._metrics)
+        metrics["pending"] = len(self._pending)
+        return metrics
+
+
+    def close(self, timeout=30):
+        """
+        Sends the pending requests (for at most <timeout> seconds), then
+        stops the notifier
+        """
+        self._closing = True
+        self._wakeup.set()
+        self._task.join(timeout)
+        if not self._task.dead:
+            logging.getLogger().warning("AUTO PROCESSING: %d request(s) not sent to %s", len(self._pending), self.server)
+            self._task.kill()
+
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._pending:
+                method, args = self._pending.popleft()
+                self._send(method, args)
+
+            if self._closing:
+                return
+
+
+    def _send(self, method, args):
+        if self._proxy is None:
+            # xmlrpclib keeps the HTTP/1.1 connection open between calls
+            self._proxy = xmlrpclib.ServerProxy("http://%s" % self.server, allow_none=True)
+
+        t0 = time.time()
+        try:
+            getattr(self._proxy, method)(*args)
+        except Exception, msg:
+            self._metrics["failed"] += 1
+            # start again with a new connection
+            self._proxy = None
+            logging.getLogger().exception("Error calling %s on auto processing server %s, is it correctly configured?: %r", method, self.server, msg)
+        else:
+            self._metrics["sent"] += 1
+            self._metrics["last_send_time"] = time.time() - t0
+
+
 class AbstractMultiCollect(object):
     __metaclass__ = abc.ABCMeta
 
@@ -65,6 +169,11 @@ class AbstractMultiCollect(object):
         self.data_collect_task = None
         self.oscillations_history = []
         self.current_lims_sample = None
+        self.auto_processing_notifier = None
+        # axes which have to reach their position before another axis
+        # starts to move (the resolution is computed for the new energy)
+        self.axis_dependencies = { "resolution": ("energy",),
+                                   "transmission": ("energy",) }
 
 
     def setControlObjects(self, **control_objects):
@@ -563,24 +672,10 @@ class AbstractMultiCollect(object):
         # data collection
         self.data_collection_hook(data_collect_parameters)
         
-        if 'transmission' in data_collect_parameters:
-          self.set_transmission(data_collect_parameters["transmission"])
+        self.prepare_beamline_axes(data_collect_parameters, motors_to_move_before_collect)
 
-        if 'wavelength' in data_collect_parameters:
-          self.set_wavelength(data_collect_parameters["wavelength"])
-        elif 'energy' in data_collect_parameters:
-          self.set_energy(data_collect_parameters["energy"])
-        
-        if 'resolution' in data_collect_parameters:
-          resolution = data_collect_parameters["resolution"]["upper"]
-          self.set_resolution(resolution)
-        elif 'detdistance' in oscillation_parameters:
-          self.move_detector(oscillation_parameters["detdistance"])
-          
         self.close_fast_shutter()
 
-        self.move_motors(motors_to_move_before_collect)
-
         with cleanup(self.close_fast_shutter):
             self.open_safety_shutter(timeout=10)
 
@@ -715,6 +810,58 @@ class AbstractMultiCollect(object):
                 frame += 1
                 
 
+    def prepare_beamline_axes(self, data_collect_parameters, motors_to_move):
+        """
+        Moves transmission, energy, resolution (or detector distance) and
+        sample motors to their data collection positions. Independent axes
+        move at the same time; an axis first waits for the axes it depends
+        on, as given by self.axis_dependencies.
+
+        Returns the time spent on each axis, in seconds.
+        """
+        oscillation_parameters = data_collect_parameters["oscillation_sequence"][0]
+        moves = {}
+
+        if 'transmission' in data_collect_parameters:
+          moves["transmission"] = (self.set_transmission, data_collect_parameters["transmission"])
+
+        if 'wavelength' in data_collect_parameters:
+          moves["energy"] = (self.set_wavelength, data_collect_parameters["wavelength"])
+        elif 'energy' in data_collect_parameters:
+          moves["energy"] = (self.set_energy, data_collect_parameters["energy"])
+        
+        if 'resolution' in data_collect_parameters:
+          moves["resolution"] = (self.set_resolution, data_collect_parameters["resolution"]["upper"])
+        elif 'detdistance' in oscillation_parameters:
+          moves["detector_distance"] = (self.move_detector, oscillation_parameters["detdistance"])
+
+        moves["motors"] = (self.move_motors, motors_to_move)
+
+        move_tasks = {}
+        timings = {}
+
+        def move_axis(axis, move, position):
+          for dependency in self.axis_dependencies.get(axis, ()):
+            if dependency in move_tasks:
+              # raises if the dependency could not be moved
+              move_tasks[dependency].get()
+          t0 = time.time()
+          move(position)
+          timings[axis] = time.time() - t0
+
+        for axis, (move, position) in moves.iteritems():
+          move_tasks[axis] = gevent.spawn(move_axis, axis, move, position)
+        gevent.joinall(move_tasks.values())
+
+        logging.getLogger("HWR").info("Beamline prepared for data collection: %s",
+                                      ", ".join(["%s %.1f s" % (axis, t) for axis, t in timings.iteritems()]))
+
+        for move_task in move_tasks.itervalues():
+          move_task.get()
+
+        return timings
+
+
     @task
     def loop(self, owner, data_collect_parameters_list):
         failed_msg = "Data collection failed!"
@@ -862,22 +1009,20 @@ class AbstractMultiCollect(object):
            else:
              logging.info("AUTO PROCESSING: %s, %s, %s, %s, %s, %s, %s, %s", process_event, EDNA_files_dir, anomalous, residues, inverse_beam, do_inducedraddam, spacegroup, cell)
              
-             try:
-                   server_proxy = xmlrpclib.Server("http://%s" % server,allow_none=True)
-             except:
-                   logging.exception("Cannot create XML-RPC server instance")
-
-             try: 
-               server_proxy.startProcessing(process_event, processAnalyseParams)
-             except Exception,msg:
-               logging.getLogger().exception("Error starting processing, is the autoprocessing server correctly configured?: %r" % msg)
+             notifier = self.get_auto_processing_notifier(server)
+             notifier.notify("startProcessing", process_event, processAnalyseParams)
 
              if process_event=="after" and do_inducedraddam:
                  #str(self.persistentValues["arguments"]["do_inducedraddam"]) == 'True':
-                 try:
-                     #logging.info("executing: server_proxy.startInducedRadDam(%r)", processAnalyseParams)
-                     server_proxy.startInducedRadDam(processAnalyseParams)
-                 except Exception, msg:
-                     logging.exception("Error starting induced rad.dam: %s", msg)
+                 notifier.notify("startInducedRadDam", processAnalyseParams)
+
+
+    def get_auto_processing_notifier(self, server):
+      if self.auto_processing_notifier is None or self.auto_processing_notifier.server != server:
+        if self.auto_processing_notifier is not None:
+          # let the old server get its pending requests without delaying the collection
+          gevent.spawn(self.auto_processing_notifier.close)
+        self.auto_processing_notifier = AutoProcessingNotifier(server)
+      return self.auto_processing_notifier
              
                
@@ -26,6 +26,13 @@ Features this version offers:
 9. Doesn't try to open reserved names on Windows.
 10. Has a tuning mechanism to change buffer performance depending on small
     or large files.
+11. Serves large files from memory maps, sending buffer views of the mapping
+    instead of copies.
+12. Keep-alive connections, with pipelined requests answered in order.
+13. Single byte range requests (206 Partial Content).
+14. Conditional GET with ETag and Last-Modified validators, cached per file.
+15. Gzip compressed variants of text files (EDNA HTML reports), taken from an
+    up-to-date file.gz on disk or compressed once and kept in memory.
 
 For most people, one can run this from the command line and get a reasonably
 functioning web server with minor issue.
@@ -45,8 +52,14 @@ tended to hang below 10% processor utilization.
 There exists a live host running this web server: nada.ics.uci.edu
 """
 
-import asynchat, asyncore, socket, BaseHTTPServer
+import asynchat, asyncore, socket, BaseHTTPServer, SimpleHTTPServer
 import sys, cgi, cStringIO, os, traceback, zlib, optparse
+import mmap, gzip, email.utils
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
 
 __version__ = ".4.1"
 
@@ -103,6 +116,65 @@ reserved_names = dict.fromkeys(('com1 com2 com3 com4 com5 com6 com7 com8 com9 '
                                 'lpt1 lpt2 lpt3 lpt4 lpt5 lpt6 lpt7 lpt8 lpt9 '
                                 'con nul prn').split())
 
+#marks the end of a response on a keep-alive connection
+END_OF_REQUEST = object()
+
+#content types worth sending gzip compressed
+compressible_types = ('text/html', 'text/plain', 'text/css', 'text/xml',
+                      'application/javascript', 'application/xml')
+
+def parse_byte_range(value, size):
+    """Parse a 'Range: bytes=...' header value for a body of the given size.
+
+    Returns the (first, last) byte positions, or None if the header is not a
+    single byte range (the whole body should then be sent). Raises ValueError
+    if the range cannot be satisfied."""
+    unit, _, ranges = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    first, sep, last = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            #suffix range: the last <last> bytes
+            first = max(size - int(last), 0)
+            last = size - 1
+        else:
+            first = int(first)
+            last = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if first > last or first >= size:
+        raise ValueError("unsatisfiable range %r" % value)
+    return first, last
+
+def gzip_string(data):
+    buf = cStringIO.StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+class MappedFile(object):
+    """File body served from a memory map: read() returns buffer objects on
+    the mapping, so no copy of the file data is made before sending it."""
+    def __init__(self, f, offset, length):
+        self.f = f
+        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.pos = offset
+        self.end = offset + length
+    def __len__(self):
+        return self.end - self.pos
+    def read(self, size):
+        size = min(size, self.end - self.pos)
+        data = buffer(self.map, self.pos, size)
+        self.pos += size
+        return data
+    def close(self):
+        self.map.close()
+        self.f.close()
+
 def popall(self):
     #Preallocate the list to save memory resizing.
     r = len(self)*[None]
@@ -147,7 +219,7 @@ class ParseHeaders(dict):
     def get(self,key,default=""):
         return self._ci_dict.get(key.lower(),default)
 #
-class RequestHandler(asynchat.async_chat, BaseHTTPServer.BaseHTTPRequestHandler):
+class RequestHandler(asynchat.async_chat, SimpleHTTPServer.SimpleHTTPRequestHandler):
     if 1:
         server_version = "BaseAsyncHTTPServer/"+__version__
         protocol_version = "HTTP/1.1"
@@ -159,6 +231,9 @@ class RequestHandler(asynchat.async_chat, BaseHTTPServer.BaseHTTPRequestHandler)
         #sent.
         use_buffer = False
         use_favicon = True
+
+        #files of at least this size are sent from a memory map
+        mmap_threshold = 65536
     
     def __init__(self, conn, addr, server):
         asynchat.async_chat.__init__(self,conn)
@@ -215,6 +290,10 @@ class RequestHandler(asynchat.async_chat, BaseHTTPServer.BaseHTTPRequestHandler)
             self.path = self.path[:qspos]
 
         self.handle_data()
+
+    def do_HEAD(self):
+        """Serves a HEAD request: same headers as GET, no body"""
+        self.do_GET()
         
     def do_POST(self):
         """Begins serving a POST request. The request data must be readable
@@ -244,23 +323,40 @@ class RequestHandler(asynchat.async_chat, BaseHTTPServer.BaseHTTPRequestHandler)
             return
         
         f = self.send_head()
-        if f:
+        if f is not None:
             # do some special things with file objects so that we don't have
             # to read them all into memory at the same time...may leave a
             # file handle open for longer than is really desired, but it does
             # make it able to handle files of unlimited size.
             try:
-                size = os.fstat(f.fileno())[6]
-            except AttributeError:
-                size = f.len
+                size = len(f)
+            except TypeError:
+                try:
+                    size = os.fstat(f.fileno())[6]
+                except AttributeError:
+                    size = len(f.getvalue())
             self.update_b(size)
             self.log_request(self.code, size)
-            self.outgoing.append(f)
+            if self.command == 'HEAD':
+                if hasattr(f, 'close'):
+                    f.close()
+            else:
+                self.outgoing.append(f)
         else:
             self.log_request(self.code)
         
         # signal the end of this request
-        self.outgoing.append(None)
+        self.end_request()
+
+    def end_request(self):
+        """Queues the end of the current response, and gets ready to read
+        the next request if the connection is kept alive"""
+        if self.close_connection:
+            self.outgoing.append(None)
+        else:
+            self.outgoing.append(END_OF_REQUEST)
+            self.set_terminator('\r\n\r\n')
+            self.found_terminator = self.handle_request_line
 
     def handle_request_line(self):
         """Called when the http request line and headers have been received"""
@@ -268,7 +364,12 @@ class RequestHandler(asynchat.async_chat, BaseHTTPServer.BaseHTTPRequestHandler)
         self.rfile = cStringIO.StringIO(''.join(popall(self.incoming)))
         self.rfile.seek(0)
         self.raw_requestline = self.rfile.readline()
-        self.parse_request()
+        self.code = None
+        if not self.parse_request():
+            # an error response has already been queued
+            self.close_connection = 1
+            self.end_request()
+            return
 
         if self.command in ['GET','HEAD']:
             # if method is GET or HEAD, call do_GET or do_HEAD and finish
@@ -280,6 +381,7 @@ class RequestHandler(asynchat.async_chat, BaseHTTPServer.BaseHTTPRequestHandler)
             self.prepare_POST()
         else:
             self.send_error(501, "Unsupported method (%s)" %self.command)
+            self.end_request()
 
     def end_headers(self):
         """Send the blank line ending the MIME headers, send the buffered
@@ -311,10 +413,15 @@ class RequestHandler(asynchat.async_chat, BaseHTTPServer.BaseHTTPRequestHandler)
                 # if self.close_connection:
                 self.close()
                 return
+            #end of a response on a keep-alive connection
+            elif a is END_OF_REQUEST:
+                continue
             #handle file objects
             elif hasattr(a, 'read'):
                 _a, a = a, a.read(self.blocksize)
                 if not a:
+                    if hasattr(_a, 'close'):
+                        _a.close()
                     del _a
                     continue
                 else:
@@ -363,8 +470,124 @@ class RequestHandler(asynchat.async_chat, BaseHTTPServer.BaseHTTPRequestHandler)
                 self.end_headers()
                 self.wfile.write(x)
                 return None
+            for index in ("index.html", "index.htm"):
+                index = os.path.join(path, index)
+                if os.path.isfile(index):
+                    path = index
+                    break
+            else:
+                return self.list_directory(path)
+
+        return self.send_file(path)
+
+    def send_file(self, path):
+        """Sends the headers for the file at path, honouring conditional and
+        range requests, and returns the body to send (or None)"""
+        try:
+            mtime, size, etag, last_modified = self.server.validators(path)
+        except (IOError, OSError):
+            self.send_error(404, "File not found")
+            return None
+
+        ctype = self.guess_type(path)
+        use_gzip = ctype in compressible_types and \
+                   'gzip' in (self.headers.getheader('accept-encoding') or '')
+        # the gzip compressed representation has its own entity tag
+        gzip_etag = etag[:-1] + '-gz"'
+
+        valid_etag = self.not_modified(mtime, (etag, gzip_etag),
+                                       use_gzip and gzip_etag or etag)
+        if valid_etag:
+            self.send_response(304)
+            self.send_header("ETag", valid_etag)
+            self.send_header("Last-Modified", last_modified)
+            if valid_etag == gzip_etag:
+                self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return None
+
+        first, last = 0, size - 1
+
+        byte_range = self.headers.getheader('range')
+        if_range = self.headers.getheader('if-range')
+        if byte_range and if_range and if_range not in (etag, last_modified):
+            byte_range = None
+        if byte_range:
+            try:
+                byte_range = parse_byte_range(byte_range, size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % size)
+                self.send_header("Content-Length", 0)
+                self.end_headers()
+                return None
+
+        if byte_range:
+            first, last = byte_range
+        elif use_gzip:
+            try:
+                data = self.server.gzipped(path, mtime)
+            except (IOError, OSError):
+                self.send_error(404, "File not found")
+                return None
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_header("Content-Length", len(data))
+            self.send_header("ETag", gzip_etag)
+            self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            return data
+
+        length = last - first + 1
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            self.send_error(404, "File not found")
+            return None
 
-        return BaseHTTPServer.BaseHTTPRequestHandler.send_head(self)
+        if byte_range:
+            self.send_response(206)
+            self.send_header("Content-Range",
+                             "bytes %d-%d/%d" % (first, last, size))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", length)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+
+        if length >= self.mmap_threshold:
+            self.use_buffer = True
+            return MappedFile(f, first, length)
+        try:
+            f.seek(first)
+            return f.read(length)
+        finally:
+            f.close()
+
+    def not_modified(self, mtime, etags, current_etag):
+        """Tells if the client copy, described by the If-None-Match or
+        If-Modified-Since request headers, is still valid: returns the
+        entity tag of that copy (one of etags, or current_etag), or None"""
+        if_none_match = self.headers.getheader('if-none-match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            if '*' in tags:
+                return current_etag
+            for etag in etags:
+                if etag in tags:
+                    return etag
+            return None
+        if_modified_since = self.headers.getheader('if-modified-since')
+        if if_modified_since:
+            t = email.utils.parsedate_tz(if_modified_since)
+            if t is not None and email.utils.mktime_tz(t) >= mtime:
+                return current_etag
+        return None
     
     def send_response(self, code, message=None):
         if self.code:
@@ -426,6 +649,56 @@ class Server(asyncore.dispatcher):
         #     5).
         self.listen (5)
 
+        self._validators = {}
+        if OrderedDict is not None:
+            self._gzipped = OrderedDict()
+        else:
+            self._gzipped = {}
+
+    #maximum number of gzip compressed files kept in memory
+    gzip_cache_size = 64
+
+    def validators(self, path):
+        """Returns (mtime, size, etag, last_modified) for the file at path;
+        the header values are only formatted again when the file changes"""
+        st = os.stat(path)
+        mtime, size = int(st.st_mtime), st.st_size
+        cached = self._validators.get(path)
+        if cached is None or cached[:2] != (mtime, size):
+            etag = '"%x-%x"' % (mtime, size)
+            last_modified = email.utils.formatdate(mtime, usegmt=True)
+            cached = self._validators[path] = (mtime, size, etag, last_modified)
+        return cached
+
+    def gzipped(self, path, mtime):
+        """Returns the gzip compressed content of the file at path, from an
+        up-to-date path.gz file or compressed once and kept in memory"""
+        key = (path, mtime)
+        try:
+            return self._gzipped[key]
+        except KeyError:
+            pass
+        gz_path = path + '.gz'
+        if os.path.isfile(gz_path) and os.stat(gz_path).st_mtime >= mtime:
+            f = open(gz_path, 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        else:
+            f = open(path, 'rb')
+            try:
+                data = gzip_string(f.read())
+            finally:
+                f.close()
+        if len(self._gzipped) >= self.gzip_cache_size:
+            if OrderedDict is not None:
+                self._gzipped.popitem(last=False)
+            else:
+                self._gzipped.clear()
+        self._gzipped[key] = data
+        return data
+
     def handle_accept (self):
         try:
             conn, addr = self.accept()
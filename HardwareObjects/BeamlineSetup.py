@@ -1,4 +1,5 @@
 import logging
+import time
 import jsonpickle
 
 import queue_model_objects_v1 as queue_model_objects
@@ -18,6 +19,9 @@ class BeamlineSetup(HardwareObject):
     def __init__(self, name):
         HardwareObject.__init__(self, name)
         self._object_by_path = {}
+        self._accessor_by_path = {}
+        self._value_cache = {}
+        self._value_cache_max_age = 1.0
         self._role_list = ['transmission', 'diffractometer', 'sample_changer',
                            'resolution', 'shape_history', 'session',
                            'data_analysis', 'workflow', 'lims_client',
@@ -30,11 +34,57 @@ class BeamlineSetup(HardwareObject):
         for role in self._role_list:
             self._get_object_by_role(role)
 
+        max_age = self.getProperty('value_cache_max_age')
+        if max_age is not None:
+            self._value_cache_max_age = float(max_age)
+
         self._object_by_path['/beamline/energy'] = self.energy_hwobj
         self._object_by_path['/beamline/resolution'] = self.resolution_hwobj
         self._object_by_path['/beamline/transmission'] =\
             self.transmission_hwobj
 
+        # The cached value of a path is dropped as soon as its hardware
+        # object reports a new value, and in any case after
+        # value_cache_max_age seconds, as not all of them report changes.
+        for path, hwobj in self._object_by_path.iteritems():
+            if hwobj is not None:
+                self.connect(hwobj, 'valueChanged',
+                             self._invalidator(path))
+
+    def _invalidator(self, path):
+        """
+        :returns: A slot removing the cached value of <path>.
+        :rtype: callable
+        """
+        def invalidate(*args):
+            self._value_cache.pop(path, None)
+
+        return invalidate
+
+    def _compile_path(self, path):
+        """
+        Resolves <path> once into a function returning its value.
+
+        :param path: Path to a hardware object.
+        :type path: str
+
+        :returns: A tuple (getter, cacheable)
+        :rtype: tuple
+        """
+        if path == '/beamline/default-acquisition-parameters/':
+            return (lambda: jsonpickle.encode(
+                self.get_default_acquisition_parameters()), False)
+        elif path == '/beamline/default-path-template/':
+            return (lambda: jsonpickle.encode(
+                self.get_default_path_template()), False)
+        else:
+            try:
+                hwobj = self._object_by_path[path]
+            except KeyError:
+                raise KeyError('Invalid path')
+
+            return (hwobj.get_value, True)
+
     def _get_object_by_role(self, role):
         """
         Gets the object with the role <role>' and adds the attribute
@@ -60,23 +110,40 @@ class BeamlineSetup(HardwareObject):
         :returns: The 'value' of the hardware object.
         :rtype: Return type of get_value of the hardware object.
         """
-        value = None
-
-        if path == '/beamline/default-acquisition-parameters/':
-            value = jsonpickle.encode(self.get_default_acquisition_parameters())
-        elif path == '/beamline/default-path-template/':
-            value = jsonpickle.encode(self.get_default_path_template())
+        try:
+            value, read_time = self._value_cache[path]
+        except KeyError:
+            pass
         else:
-            hwobj = None
+            if time.time() - read_time < self._value_cache_max_age:
+                return value
 
-            try:
-                hwobj = self._object_by_path[path]
-                value = hwobj.get_value()
-            except KeyError:
-                raise KeyError('Invalid path')
+        try:
+            getter, cacheable = self._accessor_by_path[path]
+        except KeyError:
+            getter, cacheable = self._compile_path(path)
+            self._accessor_by_path[path] = (getter, cacheable)
+
+        read_time = time.time()
+        value = getter()
+
+        if cacheable:
+            self._value_cache[path] = (value, read_time)
 
         return value
 
+    def read_values(self, paths):
+        """
+        Reads the values of the hardware objects at the given paths.
+
+        :param paths: Paths to hardware objects.
+        :type paths: list
+
+        :returns: The values, in the order of <paths>.
+        :rtype: list
+        """
+        return [self.read_value(path) for path in paths]
+
     def detector_has_shutterless(self):
         """
         :returns: True if the detector is capable of shuterless.
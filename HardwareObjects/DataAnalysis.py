@@ -4,6 +4,7 @@ import threading
 import subprocess
 import time
 import os
+import file_ready
 import queue_model_objects_v1 as queue_model_objects
 import queue_model_enumerables_v1 as queue_model_enumerables
 
@@ -72,6 +73,7 @@ class DataAnalysis(AbstractDataAnalysis, HardwareObject):
     def init(self):
         self.collect_obj = self.getObjectByRole("collect")
         self.start_edna_command = self.getProperty("edna_command")
+        self.results_timeout = float(self.getProperty("results_timeout") or 30)
 
   
     def get_html_report(self, edna_result):
@@ -246,7 +248,9 @@ class DataAnalysis(AbstractDataAnalysis, HardwareObject):
         self.processing_done_event = edna_processing_thread.start()
         self.processing_done_event.wait()
         
-        self.result = XSDataResultMXCuBE.parseFile(edna_results_file)
+        self.result = file_ready.wait_file_ready(edna_results_file,
+                                                 XSDataResultMXCuBE.parseFile,
+                                                 timeout=self.results_timeout).get()
         
         return self.result
        
@@ -22,6 +22,7 @@ import time
 import sys
 import os
 import atexit
+import file_ready
 
 DEBUG=0
 TEST=0
@@ -95,7 +96,7 @@ class EDNACharacterise(Equipment):
         self.default_resolution=None
         self.selectedSample = None
         self.EDNAResultsFiles = {}
-        self.EDNAWaitResultsTimers = {}
+        self.resultsTimeout = float(self.getProperty("results_timeout") or 30)
         self.imagePathProperties = {}
 
         """ D.S 20100216 all the defaults dictionary should be configured out of the code, say in the edna_config file.
@@ -312,39 +313,31 @@ class EDNACharacterise(Equipment):
 
     def getEDNAResults(self, edna_process_id):
         edna_results_file = self.EDNAResultsFiles[edna_process_id] 
-        self.EDNAWaitResultsTimers[edna_process_id] = qt.QTimer()
-        def reallyGetEDNAResults(edna_process_id=edna_process_id, edna_results_file=edna_results_file, storage_dict={"i":0}):
-            storage_dict["i"]+=1
-            if storage_dict["i"]>=3:
-              logging.getLogger().error("Timeout: cannot open EDNA results file (%s)", edna_results_file)
-              self.EDNAWaitResultsTimers[edna_process_id].stop()
-              del self.EDNAWaitResultsTimers[edna_process_id]
-              del self.imagePathProperties[edna_process_id]
-            else:
-              results = XSDataResultMXCuBE.parseFile(edna_results_file)
-              self.EDNAWaitResultsTimers[edna_process_id].stop()
-              del self.EDNAWaitResultsTimers[edna_process_id]
-              imagePrefix = self.imagePathProperties[edna_process_id]["imagePrefix"]
-              imageDir = self.imagePathProperties[edna_process_id]["imageDir"]
-              lRunN = self.imagePathProperties[edna_process_id]["lRunN"] 
-              del self.imagePathProperties[edna_process_id]
-              try:
-                  html_path = results.htmlPage.path.value
-                  self.emit('newEDNAHTML', (html_path, imagePrefix, lRunN))
-              except:
-                  logging.getLogger().exception('EDNACharacterize: no html in results')
-                 
-              try:
-                  screening_id = results.getScreeningId().getValue()
-              except:
-                  screening_id = None 
-              self.readEDNAResults(results.getCharacterisationResult(), edna_results_file, imageDir,
-                                   imagePrefix, lRunN, screeningId = screening_id)
-              
-
-        qt.QObject.connect(self.EDNAWaitResultsTimers[edna_process_id], qt.SIGNAL("timeout()"), reallyGetEDNAResults)
-        self.EDNAWaitResultsTimers[edna_process_id]._cb = reallyGetEDNAResults
-        self.EDNAWaitResultsTimers[edna_process_id].start(1000)
+        results = file_ready.wait_file_ready(edna_results_file, XSDataResultMXCuBE.parseFile, timeout=self.resultsTimeout)
+        results.rawlink(lambda results: self.EDNAResultsReady(edna_process_id, edna_results_file, results))
+
+    def EDNAResultsReady(self, edna_process_id, edna_results_file, results):
+        imagePathProperties = self.imagePathProperties.pop(edna_process_id)
+        if not results.successful():
+            logging.getLogger().error("Cannot read EDNA results file (%s): %s", edna_results_file, results.exception)
+            return
+
+        results = results.get()
+        imagePrefix = imagePathProperties["imagePrefix"]
+        imageDir = imagePathProperties["imageDir"]
+        lRunN = imagePathProperties["lRunN"] 
+        try:
+            html_path = results.htmlPage.path.value
+            self.emit('newEDNAHTML', (html_path, imagePrefix, lRunN))
+        except:
+            logging.getLogger().exception('EDNACharacterize: no html in results')
+           
+        try:
+            screening_id = results.getScreeningId().getValue()
+        except:
+            screening_id = None 
+        self.readEDNAResults(results.getCharacterisationResult(), edna_results_file, imageDir,
+                             imagePrefix, lRunN, screeningId = screening_id)
  
  
     def readEDNAResults(self, xsDataCharacterisation, results_file, imageDir,
@@ -1,6 +1,7 @@
 from HardwareRepository.BaseHardwareObjects import HardwareObject
 from AbstractMultiCollect import *
-from gevent.event import AsyncResult
+from gevent.event import AsyncResult, Event
+import gevent
 import logging
 import time
 import os
@@ -241,6 +242,15 @@ class ESRFMultiCollect(AbstractMultiCollect, HardwareObject):
                                       polarisation = bcm_pars.getProperty('polarisation'),
                                       auto_processing_server = self.getProperty("auto_processing_server"),
                                       input_files_server = self.getProperty("input_files_server"))
+
+        # <axis_dependencies>resolution:energy transmission:energy</axis_dependencies>
+        # means that resolution and transmission are set after the energy
+        axis_dependencies = self.getProperty("axis_dependencies")
+        if axis_dependencies is not None:
+            self.axis_dependencies = {}
+            for dependency in axis_dependencies.replace(",", " ").split():
+                axis, depends_on = dependency.split(":")
+                self.axis_dependencies.setdefault(axis, []).append(depends_on)
   
 	self.getChannelObject("spec_messages").connectSignal("update", self.log_message_from_spec)
 
@@ -317,9 +327,28 @@ class ESRFMultiCollect(AbstractMultiCollect, HardwareObject):
             logging.getLogger("HWR").info("Moving motor '%s' to %f", motor.getMotorMnemonic(), position)
             motor.move(position)
 
-        while any([motor.motorIsMoving() for motor in motor_position_dict.iterkeys()]):
-            logging.getLogger("HWR").info("Waiting for end of motors motion")
-            time.sleep(0.5)  
+        logging.getLogger("HWR").info("Waiting for end of motors motion")
+        self.wait_end_of_move(*motor_position_dict.keys())
+
+
+    def wait_end_of_move(self, *motors):
+        """
+        Waits until none of the motors is moving: checked again each time
+        a motor changes state, and at least every second
+        """
+        state_changed = Event()
+        def motor_state_changed(*args):
+            state_changed.set()
+
+        for motor in motors:
+            self.connect(motor, "stateChanged", motor_state_changed)
+        try:
+            while any([motor.motorIsMoving() for motor in motors]):
+                state_changed.wait(1.0)
+                state_changed.clear()
+        finally:
+            for motor in motors:
+                self.disconnect(motor, "stateChanged", motor_state_changed)
 
 
     @task
@@ -374,35 +403,38 @@ class ESRFMultiCollect(AbstractMultiCollect, HardwareObject):
         
 
     def prepare_input_files(self, files_directory, prefix, run_number, process_directory):
+        # list the processing directory once, instead of probing each name
+        try:
+          existing_dirnames = set(os.listdir(process_directory))
+        except OSError:
+          existing_dirnames = set()
+
         i = 1
 
         while True:
           xds_input_file_dirname = "xds_%s_run%s_%d" % (prefix, run_number, i)
           xds_directory = os.path.join(process_directory, xds_input_file_dirname)
 
-          if not os.path.exists(xds_directory):
+          if xds_input_file_dirname not in existing_dirnames:
             break
 
           i+=1
 
         mosflm_input_file_dirname = "mosflm_%s_run%s_%d" % (prefix, run_number, i)
         mosflm_directory = os.path.join(process_directory, mosflm_input_file_dirname)
-
-        self.raw_data_input_file_dir = os.path.join(files_directory, "process", xds_input_file_dirname)
-        self.mosflm_raw_data_input_file_dir = os.path.join(files_directory, "process", mosflm_input_file_dirname)
-        for dir in (self.raw_data_input_file_dir, xds_directory):
-          self.create_directories(dir)
-          logging.info("Creating XDS processing input file directory: %s", dir)
-          os.chmod(dir, 0777)
-        for dir in (self.mosflm_raw_data_input_file_dir, mosflm_directory):
-          self.create_directories(dir)
-          logging.info("Creating MOSFLM processing input file directory: %s", dir)
-          os.chmod(dir, 0777)
         hkl2000_dirname = "hkl2000_%s_run%s_%d" % (prefix, run_number, i)
         raw_hkl2000_dir = os.path.join(files_directory, "process", hkl2000_dirname)
         hkl2000_dir = os.path.join(process_directory, hkl2000_dirname)
-        for dir in (raw_hkl2000_dir, hkl2000_dir):
-          self.create_directories(dir)
+
+        self.raw_data_input_file_dir = os.path.join(files_directory, "process", xds_input_file_dirname)
+        self.mosflm_raw_data_input_file_dir = os.path.join(files_directory, "process", mosflm_input_file_dirname)
+
+        input_file_dirs = (self.raw_data_input_file_dir, xds_directory,
+                           self.mosflm_raw_data_input_file_dir, mosflm_directory,
+                           raw_hkl2000_dir, hkl2000_dir)
+        logging.info("Creating processing input file directories: %s", ", ".join(input_file_dirs))
+        self.create_directories(*input_file_dirs)
+        for dir in input_file_dirs:
           os.chmod(dir, 0777)
  
         try: 
@@ -417,38 +449,59 @@ class ESRFMultiCollect(AbstractMultiCollect, HardwareObject):
         return xds_directory, mosflm_directory
 
 
+    def _get_input_file_template(self, url):
+        conn = httplib.HTTPConnection(self.bl_config.input_files_server)
+        try:
+          conn.request("GET", url)
+          r = conn.getresponse()
+          return r.status, r.read()
+        finally:
+          conn.close()
+
+
+    def _write_input_file(self, filename, contents):
+        input_file = open(filename, "w")
+        try:
+          input_file.write(contents)
+        finally:
+          input_file.close()
+        os.chmod(filename, 0666)
+
+
     @task
     def write_input_files(self, collection_id):
         # assumes self.xds_directory and self.mosflm_directory are valid
-        conn = httplib.HTTPConnection(self.bl_config.input_files_server)
-        for input_file_dir, file_prefix in ((self.raw_data_input_file_dir, "../.."), (self.xds_directory, "../links")): 
-	  xds_input_file = os.path.join(input_file_dir, "XDS.INP")
-          conn.request("GET", "/xds.inp/%d?basedir=%s" % (collection_id, file_prefix))
-          xds_file = open(xds_input_file, "w")
-          r = conn.getresponse()
-          if r.status != 200:
+        xds_files = ((self.raw_data_input_file_dir, "../.."), (self.xds_directory, "../links"))
+        mosflm_files = ((self.mosflm_raw_data_input_file_dir, "../.."), (self.mosflm_directory, "../links"))
+        stac_url = "/stac.descr/%d" % collection_id
+
+        # each distinct template is requested once, all requests in parallel
+        urls = set(["/xds.inp/%d?basedir=%s" % (collection_id, file_prefix) for _, file_prefix in xds_files])
+        urls.update(["/mosflm.inp/%d?basedir=%s" % (collection_id, file_prefix) for _, file_prefix in mosflm_files])
+        urls.add(stac_url)
+        requests = dict([(url, gevent.spawn(self._get_input_file_template, url)) for url in urls])
+        gevent.joinall(requests.values(), raise_error=True)
+        templates = dict([(url, request.get()) for url, request in requests.iteritems()])
+
+        for input_file_dir, file_prefix in xds_files:
+          status, xds_template = templates["/xds.inp/%d?basedir=%s" % (collection_id, file_prefix)]
+          if status != 200:
             logging.error("Could not create input file")
             return
-          xds_file.write(r.read())
-          xds_file.close()
-          os.chmod(xds_input_file, 0666)
-        for input_file_dir, file_prefix in ((self.mosflm_raw_data_input_file_dir, "../.."), (self.mosflm_directory, "../links")): 
-	  mosflm_input_file = os.path.join(input_file_dir, "mosflm.inp")
-          conn.request("GET", "/mosflm.inp/%d?basedir=%s" % (collection_id, file_prefix))
-          mosflm_file = open(mosflm_input_file, "w")
-          mosflm_file.write(conn.getresponse().read()) 
-          mosflm_file.close()
-          os.chmod(mosflm_input_file, 0666)
+          self._write_input_file(os.path.join(input_file_dir, "XDS.INP"), xds_template)
+        for input_file_dir, file_prefix in mosflm_files:
+          status, mosflm_template = templates["/mosflm.inp/%d?basedir=%s" % (collection_id, file_prefix)]
+          self._write_input_file(os.path.join(input_file_dir, "mosflm.inp"), mosflm_template)
         
-        # also write input file for STAC
+        # also write input file for STAC, all from the same motor positions
+        stac_template = templates[stac_url][1]
+        diffractometer = self.bl_control.diffractometer
+        motor_positions = diffractometer.get_positions(("phi", "sampx", "sampy", "phiy"))
+
         for stac_om_input_file_name, stac_om_dir in (("mosflm.descr", self.mosflm_directory), 
                                                      ("xds.descr", self.xds_directory),
                                                      ("mosflm.descr", self.mosflm_raw_data_input_file_dir),
                                                      ("xds.descr", self.raw_data_input_file_dir)):
-          stac_om_input_file = os.path.join(stac_om_dir, stac_om_input_file_name)
-          conn.request("GET", "/stac.descr/%d" % collection_id)
-          stac_om_file = open(stac_om_input_file, "w")
-          stac_template = conn.getresponse().read()
           if stac_om_input_file_name.startswith("xds"):
             om_type="xds"
             if stac_om_dir == self.raw_data_input_file_dir:
@@ -459,13 +512,8 @@ class ESRFMultiCollect(AbstractMultiCollect, HardwareObject):
             om_type="mosflm"
             om_filename=os.path.join(stac_om_dir, "bestfile.par")
        
-          stac_om_file.write(stac_template.format(omfilename=om_filename, omtype=om_type, 
-                             phi=self.bl_control.diffractometer.phiMotor.getPosition(), 
-                             sampx=self.bl_control.diffractometer.sampleXMotor.getPosition(), 
-                             sampy=self.bl_control.diffractometer.sampleYMotor.getPosition(), 
-                             phiy=self.bl_control.diffractometer.phiyMotor.getPosition()))
-          stac_om_file.close()
-          os.chmod(stac_om_input_file, 0666)
+          self._write_input_file(os.path.join(stac_om_dir, stac_om_input_file_name),
+                                 stac_template.format(omfilename=om_filename, omtype=om_type, **motor_positions))
 
 
     def get_wavelength(self):
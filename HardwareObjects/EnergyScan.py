@@ -9,6 +9,9 @@ import time
 import types
 import math
 import gevent
+import numpy
+import cStringIO
+import file_numbering
 
 class EnergyScan(Equipment):
     def init(self):
@@ -304,55 +307,45 @@ class EnergyScan(Equipment):
         symbol = "_".join((elt, edge))
         scanArchiveFilePrefix = "_".join((scanArchiveFilePrefix, symbol))
 
-        i = 1
-        while os.path.isfile(os.path.extsep.join((scanArchiveFilePrefix + str(i), "raw"))):
-            i = i + 1
+        if not os.path.exists(os.path.dirname(scanArchiveFilePrefix)):
+            os.makedirs(os.path.dirname(scanArchiveFilePrefix))
+
+        i, archiveRawScanFile = file_numbering.reserve_filename(os.path.extsep.join((scanArchiveFilePrefix + "%d", "raw")))
 
         scanArchiveFilePrefix = scanArchiveFilePrefix + str(i) 
-        archiveRawScanFile=os.path.extsep.join((scanArchiveFilePrefix, "raw"))
         rawScanFile=os.path.extsep.join((scanFilePrefix, "raw"))
         scanFile=os.path.extsep.join((scanFilePrefix, "efs"))
-
-        if not os.path.exists(os.path.dirname(scanArchiveFilePrefix)):
-            os.makedirs(os.path.dirname(scanArchiveFilePrefix))
         
+        if scanObject is None:                
+            raw_data_file = os.path.join(os.path.dirname(scanFilePrefix), 'data.raw')
+            scanData = numpy.loadtxt(raw_data_file, delimiter='\t', skiprows=2, usecols=(0, 1), ndmin=2)
+        else:
+            scanData = numpy.column_stack((numpy.asarray(scanObject.x, dtype=float),
+                                           numpy.asarray(scanObject.y, dtype=float)))
+        x = scanData[:, 0]
+        x[x < 1000] *= 1000.0
+        scanData = numpy.ascontiguousarray(scanData, dtype=float)
+
+        # format the points once, then write the same buffer to both copies
+        buf = cStringIO.StringIO()
+        numpy.savetxt(buf, scanData, fmt="%f", delimiter=",", newline="\r\n")
         try:
-            f=open(rawScanFile, "w")
-            pyarch_f=open(archiveRawScanFile, "w")
+            for filename in (rawScanFile, archiveRawScanFile):
+                f = open(filename, "wb")
+                try:
+                    f.write(buf.getvalue())
+                finally:
+                    f.close()
         except:
             logging.getLogger("HWR").exception("could not create raw scan files")
+            file_numbering.release_filename(archiveRawScanFile)
             self.storeEnergyScan()
             self.emit("energyScanFailed", ())
             return
         else:
-            scanData = []
-            
-            if scanObject is None:                
-                raw_data_file = os.path.join(os.path.dirname(scanFilePrefix), 'data.raw')
-                raw_file = open(raw_data_file, 'r')
-
-                for line in raw_file.readlines()[2:]:
-                    (x, y) = line.split('\t')
-                    x = float(x.strip())
-                    y = float(y.strip())
-                    x = x < 1000 and x*1000.0 or x
-                    scanData.append((x, y))
-                    f.write("%f,%f\r\n" % (x, y))
-                    pyarch_f.write("%f,%f\r\n"% (x, y))
-            else:
-                for i in range(len(scanObject.x)):
-                    x = float(scanObject.x[i])
-                    x = x < 1000 and x*1000.0 or x 
-                    y = float(scanObject.y[i])
-                    scanData.append((x, y))
-                    f.write("%f,%f\r\n" % (x, y))
-                    pyarch_f.write("%f,%f\r\n"% (x, y)) 
-
-            f.close()
-            pyarch_f.close()
             self.scanInfo["scanFileFullPath"]=str(archiveRawScanFile)
 
-        pk, fppPeak, fpPeak, ip, fppInfl, fpInfl, chooch_graph_data = PyChooch.calc(scanData, elt, edge, scanFile)
+        pk, fppPeak, fpPeak, ip, fppInfl, fpInfl, chooch_graph_data = PyChooch.calc(scanData.tolist(), elt, edge, scanFile)
         rm=(pk+30)/1000.0
         pk=pk/1000.0
         savpk = pk
@@ -402,7 +395,7 @@ class EnergyScan(Equipment):
         ax=fig.add_subplot(211)
         ax.set_title("%s\n%s" % (scanFile, title))
         ax.grid(True)
-        ax.plot(*(zip(*scanData)), **{"color":'black'})
+        ax.plot(scanData[:, 0], scanData[:, 1], **{"color":'black'})
         ax.set_xlabel("Energy")
         ax.set_ylabel("MCA counts")
         ax2=fig.add_subplot(212)
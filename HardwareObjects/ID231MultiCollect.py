@@ -31,8 +31,7 @@ class ID231MultiCollect(ESRFMultiCollect):
     @task
     def move_detector(self, detector_distance):
         self.bl_control.detector_distance.move(detector_distance)
-        while self.bl_control.detector_distance.motorIsMoving():
-            time.sleep(0.5)
+        self.wait_end_of_move(self.bl_control.detector_distance)
 
     def get_detector_distance(self):
         return self.bl_control.detector_distance.getPosition()
@@ -40,8 +39,7 @@ class ID231MultiCollect(ESRFMultiCollect):
     @task
     def set_resolution(self, new_resolution):
         self.bl_control.resolution.move(new_resolution, wait=False)
-        while self.bl_control.resolution.motorIsMoving():
-            time.sleep(0.5)
+        self.wait_end_of_move(self.bl_control.resolution)
 
     def trigger_auto_processing(self, process_event, *args, **kwargs):       
         if process_event in ('before', 'after'):
@@ -3,6 +3,7 @@
 from HardwareRepository import BaseHardwareObjects
 import logging
 import os
+import numpy
 import PyTango
 
 #try:
@@ -28,7 +29,21 @@ class MicrodiffCamera(BaseHardwareObjects.Device):
 
 
     def takeSnapshot(self, *args):
-      jpeg_data=self.device.GrabImage()
-      f = open(*(args + ("w",)))
-      f.write("".join(map(chr, jpeg_data)))
-      f.close()       
+      """Grab a JPEG snapshot from the device
+
+      If a filename is given, the image is written to it; otherwise the
+      JPEG data is returned as a string, without going through the disk
+      """
+      # GrabImage returns a sequence of bytes values: convert it to a
+      # string in one go through the buffer protocol, instead of creating
+      # one Python string object per byte
+      jpeg_data = numpy.asarray(self.device.GrabImage(), numpy.uint8).tostring()
+
+      if not args:
+        return jpeg_data
+
+      f = open(args[0], "wb")
+      try:
+        f.write(jpeg_data)
+      finally:
+        f.close()
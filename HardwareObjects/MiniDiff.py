@@ -3,7 +3,6 @@ from gevent.event import AsyncResult
 from Qub.Tools import QubImageSave
 from HardwareRepository.BaseHardwareObjects import Equipment
 from HardwareRepository.TaskUtils import *
-import Image
 import tempfile
 import logging
 import numpy
@@ -11,23 +10,153 @@ import math
 import os
 import time
 from HardwareRepository import HardwareRepository
-import copy
+import itertools
+import collections
+from video_frame_bus import VideoFrameBus
+from loop_finder import LoopFinderPool
+from centring_solver import fit_rotation, centring_offsets
 try:
   import lucid
 except ImportError:
+  lucid = None
   logging.warning("lucid cannot load: automatic centring is disabled")
 
 
 USER_CLICKED_EVENT = AsyncResult()
 
 
-def manual_centring(phi, phiy, phiz, sampx, sampy, pixelsPerMmY, pixelsPerMmZ, imgWidth, imgHeight, phiy_direction=1):
+class _ReadOnlyDict(collections.Mapping):
+    def __init__(self, d):
+        self._d = d
+    def __getitem__(self, key):
+        return self._d[key]
+    def __iter__(self):
+        return iter(self._d)
+    def __len__(self):
+        return len(self._d)
+    def __repr__(self):
+        return repr(self._d)
+
+
+def _freeze(value):
+    if isinstance(value, (CentringResult, _ReadOnlyDict)):
+        return value
+    if isinstance(value, dict):
+        return _ReadOnlyDict(dict((k, _freeze(v)) for k, v in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        frozen = tuple(_freeze(v) for v in value)
+        if isinstance(value, tuple) and all(a is b for a, b in zip(frozen, value)):
+            return value
+        return frozen
+    return value
+
+
+class CentringResult(collections.Mapping):
+    """Read-only centring status (motors, method, images...)
+
+    updated() returns a new version sharing the unchanged values with this
+    one, so the status can be handed out without being copied.
+    """
+    _versions = itertools.count()
+
+    def __init__(self, items=(), **kwargs):
+        data = dict(items)
+        data.update(kwargs)
+        self._data = dict((k, _freeze(v)) for k, v in data.iteritems())
+        self.version = next(CentringResult._versions)
+
+    def updated(self, **changes):
+        return CentringResult(self._data, **changes)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return "CentringResult(version=%d, %r)" % (self.version, self._data)
+
+
+class MotorPositionCache:
+    """Last known motor positions, kept up to date from positionChanged signals
+
+    Not all motors report every move, so positions older than max_age
+    seconds are read again from the motor.
+    """
+    def __init__(self, max_age=0.5):
+        self.max_age = max_age
+        self._motors = {}
+        self._positions = {}
+        self._slots = []
+
+    def add_motor(self, name, motor):
+        if motor is None:
+            return
+        self._motors[name] = motor
+        def position_changed(pos, *args):
+            self._positions[motor] = (pos, time.time())
+        # keep a reference, the dispatcher only holds weak references to slots
+        self._slots.append(position_changed)
+        motor.connect("positionChanged", position_changed)
+
+    def motor_position(self, motor, max_age=None):
+        if max_age is None:
+            max_age = self.max_age
+        try:
+            pos, t = self._positions[motor]
+        except KeyError:
+            pass
+        else:
+            if time.time() - t <= max_age:
+                return pos
+        pos = motor.getPosition()
+        self._positions[motor] = (pos, time.time())
+        return pos
+
+    def get_positions(self, names=None, max_age=None):
+        if names is None:
+            names = self._motors.keys()
+        return dict([(name, self.motor_position(self._motors[name], max_age)) for name in names])
+
+
+def centring_angles(n_points):
+  # n_points angles over half a turn, relative to the first one
+  return [i * 180.0 / (n_points - 1) for i in range(n_points)]
+
+
+def centred_position(angles, X, Y, phiDialPosition, pixelsPerMmY, pixelsPerMmZ, imgWidth, imgHeight, phiy_direction, motors, getPosition):
+  sampx, sampy, phiy, phiz = motors
+  fit = fit_rotation(angles, X, Y)
+  logging.getLogger("HWR").debug("MiniDiff: centring fit on %d points, rms %.1f pixels, %d outlier(s)", len(X), fit.rms, fit.outliers.sum())
+  dx, dy, dphiy, dphiz = centring_offsets(fit, phiDialPosition, pixelsPerMmY, pixelsPerMmZ, imgWidth, imgHeight, phiy_direction)
+  return { sampx: getPosition(sampx) + float(dx),
+           sampy: getPosition(sampy) + float(dy),
+           phiy: getPosition(phiy) + float(dphiy),
+           phiz: getPosition(phiz) + float(dphiz) }
+
+
+def manual_centring(phi, phiy, phiz, sampx, sampy, pixelsPerMmY, pixelsPerMmZ, imgWidth, imgHeight, phiy_direction=1, positions=None, n_points=3):
   global USER_CLICKED_EVENT
   X, Y = [], []
+  angles = centring_angles(n_points)
   centredPosRel = {}
+  if positions is None:
+    getPosition = lambda motor: motor.getPosition()
+  else:
+    getPosition = positions.motor_position
 
   if all([x.isReady() for x in (phi, phiy, phiz, sampx, sampy)]):
-    phiSavedPosition = phi.getPosition()
+    phiSavedPosition = getPosition(phi)
     phiSavedDialPosition = phi.getDialPosition()
   else:
     raise RuntimeError, "motors not ready"
@@ -38,29 +167,12 @@ def manual_centring(phi, phiy, phiz, sampx, sampy, pixelsPerMmY, pixelsPerMmZ, i
       x, y = USER_CLICKED_EVENT.get()
       X.append(x)
       Y.append(y)
-      if len(X) == 3:
+      if len(X) == n_points:
         break
-      phi.moveRelative(90)
-
-    beam_xc = imgWidth / 2
-    beam_yc = imgHeight / 2
-    yc = (Y[0]+Y[2]) / 2
-    y =  Y[0] - yc
-    x =  yc - Y[1]
-    b1 = -math.radians(phiSavedDialPosition)
-    rotMatrix = numpy.matrix([math.cos(b1), -math.sin(b1), math.sin(b1), math.cos(b1)])
-    rotMatrix.shape = (2,2)
-    dx, dy = numpy.dot(numpy.array([x,y]), numpy.array(rotMatrix))/pixelsPerMmY 
-
-    beam_xc_real = beam_xc / float(pixelsPerMmY)
-    beam_yc_real = beam_yc / float(pixelsPerMmZ)
-    y = yc / float(pixelsPerMmZ)
-    x = sum(X) / 3.0 / float(pixelsPerMmY)
-    centredPos = { sampx: sampx.getPosition() + float(dx),
-                   sampy: sampy.getPosition() + float(dy),
-                   phiy: phiy.getPosition() + phiy_direction * (x - beam_xc_real),
-                   phiz: phiz.getPosition() + (y - beam_yc_real) }
-    return centredPos
+      phi.moveRelative(angles[len(X)] - angles[len(X)-1])
+
+    return centred_position(angles, X, Y, phiSavedDialPosition, pixelsPerMmY, pixelsPerMmZ, imgWidth, imgHeight,
+                            phiy_direction, (sampx, sampy, phiy, phiz), getPosition)
   except:
     phi.move(phiSavedPosition)    
     raise
@@ -95,8 +207,16 @@ class myimage:
         return self.imgcopy
 
 
-def take_snapshots(light, phi, zoom, drawing):
+def take_snapshots(light, phi, zoom, drawing, camera=None):
   centredImages = []
+
+  if drawing is None and hasattr(camera, "takeSnapshot"):
+    # no video display: JPEG images encoded by the camera device, in
+    # memory (the video frame bus only serves RGB frames); with a display,
+    # the snapshots must show its overlays (Qt pixmap)
+    grab_image = camera.takeSnapshot
+  else:
+    grab_image = lambda: str(myimage(drawing))
   
   if light is not None:
     light.wagoIn()
@@ -104,7 +224,7 @@ def take_snapshots(light, phi, zoom, drawing):
       time.sleep(0.5)
   for i in range(4):
      logging.getLogger("HWR").info("MiniDiff: taking snapshot #%d", i+1)
-     centredImages.append((phi.getPosition(),str(myimage(drawing))))
+     centredImages.append((phi.getPosition(),grab_image()))
      phi.syncMoveRelative(-90)
 
   centredImages.reverse() # snapshot order must be according to positive rotation direction
@@ -128,10 +248,13 @@ class MiniDiff(Equipment):
         self.sampleXMotor = None
         self.sampleYMotor = None
         self.camera = None
+        self.videoBus = None
+        self.loopFinder = None
         self.sampleChanger = None
         self.lightWago = None
         self.currentSampleInfo = None
         self.aperture = None
+        self._drawing = None
       
         self.pixelsPerMmY=None
         self.pixelsPerMmZ=None
@@ -152,7 +275,8 @@ class MiniDiff(Equipment):
         self.currentCentringProcedure = None
         self.currentCentringMethod = None
 
-        self.centringStatus={"valid":False}
+        self.centringStatus=CentringResult(valid=False)
+        self.centringPoints = int(self.getProperty("centring_points") or 3)
 
         self.phiMotor = self.getDeviceByRole('phi')
         self.phizMotor = self.getDeviceByRole('phiz')
@@ -164,7 +288,27 @@ class MiniDiff(Equipment):
         self.sampleYMotor = self.getDeviceByRole('sampy')
         self.camera = self.getDeviceByRole('camera')
 
+        self.positions = MotorPositionCache()
+        max_age = self.getProperty("positions_max_age")
+        if max_age is not None:
+            self.positions.max_age = float(max_age)
+        for motor_role in ('phi', 'phiy', 'phiz', 'sampx', 'sampy', 'zoom', 'focus', 'light'):
+            self.positions.add_motor(motor_role, self.getDeviceByRole(motor_role))
+
+        shared_frames = self.getProperty("shared_video_frames") or False
+        self.videoBus = VideoFrameBus(lambda: self.camera.getChannelObject("RgbImage").getValue(),
+                                      self.camera.getWidth(), self.camera.getHeight(),
+                                      slots=8, shared=shared_frames)
+        # loop finding worker processes are only forked if configured (and
+        # usable): by default, frames are analysed in this process
+        loop_finder_processes = lucid is not None and self.getProperty("loop_finder_processes") or 0
+        self.loopFinder = LoopFinderPool(int(loop_finder_processes),
+                                         shared_frames and self.videoBus or None,
+                                         self.getProperty("loop_finder_timeout") or 10)
+        self.loopFinder.start()
+
         self.camera.addChannel({ 'type': 'tango', 'name': 'jpegImage' }, "JpegImage")
+        self.camera.addChannel({ 'type': 'tango', 'name': 'rgbimage', "read_as_str": 1 }, "RgbImage")
 
         sc_prop=self.getProperty("samplechanger")
         if sc_prop is not None:
@@ -370,7 +514,7 @@ class MiniDiff(Equipment):
 
     def invalidateCentring(self):
         if self.currentCentringProcedure is None and self.centringStatus["valid"]:
-            self.centringStatus={"valid":False}
+            self.centringStatus=CentringResult(valid=False)
             self.emitProgressMessage("")
             self.emit('centringInvalid', ())
 
@@ -413,7 +557,7 @@ class MiniDiff(Equipment):
             return
         
         curr_time=time.strftime("%Y-%m-%d %H:%M:%S")
-        self.centringStatus={"valid":False, "startTime":curr_time}
+        self.centringStatus=CentringResult(valid=False, startTime=curr_time)
 
         self.emitCentringStarted(method)
 
@@ -469,7 +613,9 @@ class MiniDiff(Equipment):
                                                      self.pixelsPerMmZ,
                                                      self.imgWidth,
                                                      self.imgHeight,
-                                                     self.phiy_direction)
+                                                     self.phiy_direction,
+                                                     self.positions,
+                                                     self.centringPoints)
          
         self.currentCentringProcedure.link(self.manualCentringDone)
 
@@ -545,6 +691,9 @@ class MiniDiff(Equipment):
           self.emitCentringSuccessful()
               
 
+    def getVideoBus(self):
+        return self.videoBus
+
     def do_auto_centring(self, phi, phiy, phiz, sampx, sampy, zoom, camera, phiy_direction):
         if not lucid:
           return
@@ -552,14 +701,15 @@ class MiniDiff(Equipment):
         imgWidth = camera.getWidth()
         imgHeight = camera.getHeight()
 
-        def find_loop(pixels_per_mm_horizontal, show_point=True):
-          #img_array = numpy.fromstring(camera.getChannelObject("image").getValue(), numpy.uint8)
-          rgbImgChan    = camera.addChannel({ 'type': 'tango', 'name': 'rgbimage', "read_as_str": 1 }, "RgbImage")
-          raw_data = rgbImgChan.getValue()
-          snapshot_filename = os.path.join(tempfile.gettempdir(), "mxcube_sample_snapshot.png")
-          Image.fromstring("RGB", (imgWidth, imgHeight), raw_data).save(snapshot_filename)
+        def analyse_frame(pixels_per_mm_horizontal):
+          # the sample has just moved: take a frame grabbed from now on, and
+          # analyse it in the loop finder processes while the caller goes on
+          return self.loopFinder.find_loop(self.videoBus.next_frame(), pixels_per_mm_horizontal)
 
-          info, x, y = lucid.find_loop(snapshot_filename, pixels_per_mm_horizontal=pixels_per_mm_horizontal)
+        def find_loop(pixels_per_mm_horizontal, show_point=True, analysis=None):
+          if analysis is None:
+            analysis = analyse_frame(pixels_per_mm_horizontal)
+          info, x, y = self.loopFinder.get(analysis)
           
           self.emitProgressMessage("Loop found: %s (%d, %d)" % (info, x, y))
           logging.debug("Loop found: %s (%d, %d)" % (info, x, y))
@@ -574,12 +724,22 @@ class MiniDiff(Equipment):
          
           self.emitProgressMessage("Doing automatic centring")
           a = 0
-          for angle in (0, 90, 90):
+          analyses = []
+          angles = centring_angles(self.centringPoints)
+          for angle in numpy.diff([0] + angles):
             a+=1
             self.emitProgressMessage("%d: moving at angle %f" % (a, phi.getPosition()+angle))
             phi.syncMoveRelative(angle)
-            x, y = find_loop(pixelsPerMmY) 
+            analyses.append((phi.getPosition(), analyse_frame(pixelsPerMmY)))
+          lastPhiPosition = analyses[-1][0]
+          movedBack = False
+
+          for phiPosition, analysis in analyses:
+            x, y = find_loop(pixelsPerMmY, analysis=analysis)
             if x < 0 or y < 0:
+              # go back to the angle of the image to search around it
+              phi.syncMove(phiPosition)
+              movedBack = True
               for i in range(1,5):
                 logging.debug("loop not found - moving back") 
                 phi.syncMoveRelative(-20)
@@ -606,26 +766,11 @@ class MiniDiff(Equipment):
               phi.syncMoveRelative(i*20)
             else:
               X.append(x); Y.append(y)
+          if movedBack:
+            phi.syncMove(lastPhiPosition)
               
-          beam_xc = imgWidth / 2
-          beam_yc = imgHeight / 2
-          yc = (Y[0]+Y[2]) / 2
-          y =  Y[0] - yc
-          x =  yc - Y[1]
-          b1 = -math.radians(phiSavedDialPosition)
-          rotMatrix = numpy.matrix([math.cos(b1), -math.sin(b1), math.sin(b1), math.cos(b1)])
-          rotMatrix.shape = (2,2)
-          dx, dy = numpy.dot(numpy.array([x,y]), numpy.array(rotMatrix))/pixelsPerMmY
-
-          beam_xc_real = beam_xc / float(pixelsPerMmY)
-          beam_yc_real = beam_yc / float(pixelsPerMmZ)
-          y = yc / float(pixelsPerMmZ)
-          x = sum(X) / 3.0 / float(pixelsPerMmY)
-          centredPos = { sampx: sampx.getPosition() + float(dx),
-                         sampy: sampy.getPosition() + float(dy),
-                         phiy: phiy.getPosition() + phiy_direction * (x - beam_xc_real),
-                         phiz: phiz.getPosition() + (y - beam_yc_real) }
-          return centredPos
+          return centred_position(angles, X, Y, phiSavedDialPosition, pixelsPerMmY, pixelsPerMmZ, imgWidth, imgHeight,
+                                  phiy_direction, (sampx, sampy, phiy, phiz), lambda motor: motor.getPosition())
 
         def check_centring(pixels_per_mm_horizontal):
           centring_results = []
@@ -703,14 +848,13 @@ class MiniDiff(Equipment):
 
 
     def acceptCentring(self):
-        self.centringStatus["valid"]=True
-        self.centringStatus["accepted"]=True
+        self.centringStatus=self.centringStatus.updated(valid=True, accepted=True)
         self.emit('centringAccepted', (True,self.getCentringStatus()))
 
     def rejectCentring(self):
         if self.currentCentringProcedure:
           self.currentCentringProcedure.kill()
-        self.centringStatus={"valid":False}
+        self.centringStatus=CentringResult(valid=False)
         self.emitProgressMessage("")
         self.emit('centringAccepted', (False,self.getCentringStatus()))
 
@@ -720,7 +864,7 @@ class MiniDiff(Equipment):
 
 
     def emitCentringFailed(self):
-        self.centringStatus={"valid":False}
+        self.centringStatus=CentringResult(valid=False)
         method=self.currentCentringMethod
         self.currentCentringMethod = None
         self.currentCentringProcedure=None
@@ -730,7 +874,6 @@ class MiniDiff(Equipment):
     def emitCentringSuccessful(self):
         if self.currentCentringProcedure is not None:
             curr_time=time.strftime("%Y-%m-%d %H:%M:%S")
-            self.centringStatus["endTime"]=curr_time
 
             motors = {}
             motor_pos = self.currentCentringProcedure.get()
@@ -739,10 +882,11 @@ class MiniDiff(Equipment):
                 try:
                     motors[motor_role] = motor_pos[mot_obj] 
                 except KeyError:
-                    motors[motor_role] = mot_obj.getPosition()
-            self.centringStatus["motors"]=motors
-            self.centringStatus["method"]=self.currentCentringMethod
-            self.centringStatus["valid"]=True
+                    motors[motor_role] = self.positions.motor_position(mot_obj)
+            self.centringStatus=self.centringStatus.updated(endTime=curr_time,
+                                                            motors=motors,
+                                                            method=self.currentCentringMethod,
+                                                            valid=True)
             
             method=self.currentCentringMethod
             self.emit('centringSuccessful', (method,self.getCentringStatus()))
@@ -758,16 +902,16 @@ class MiniDiff(Equipment):
 
 
     def getCentringStatus(self):
-        return copy.deepcopy(self.centringStatus)
+        return self.centringStatus
 
 
     def getPositions(self):
-      return { "phi": self.phiMotor.getPosition(),
-               "focus": self.focusMotor.getPosition(),
-               "phiy": self.phiyMotor.getPosition(),
-               "phiz": self.phizMotor.getPosition(),
-               "sampx": self.sampleXMotor.getPosition(),
-               "sampy": self.sampleYMotor.getPosition() }
+      return self.get_positions(("phi", "focus", "phiy", "phiz", "sampx", "sampy"))
+
+
+    def get_positions(self, names=None, max_age=None):
+      """Motor positions by role, from the positions cache unless older than max_age (s, default: positions_max_age)"""
+      return self.positions.get_positions(names, max_age)
     
 
     def takeSnapshots(self, wait=False):
@@ -780,21 +924,21 @@ class MiniDiff(Equipment):
         # if not centring_valid:
         #     logging.getLogger("HWR").error("MiniDiff: you must centre the crystal before taking the snapshots")
         # else:
-        snapshotsProcedure = gevent.spawn(take_snapshots, self.lightWago,self.phiMotor,self.zoomMotor,self._drawing)
+        snapshotsProcedure = gevent.spawn(take_snapshots, self.lightWago,self.phiMotor,self.zoomMotor,self._drawing,self.camera)
         self.emit('centringSnapshots', (None,))
         self.emitProgressMessage("Taking snapshots")
-        self.centringStatus["images"]=[]
+        self.centringStatus=self.centringStatus.updated(images=[])
         snapshotsProcedure.link(self.snapshotsDone)
 
         if wait:
-          self.centringStatus["images"] = snapshotsProcedure.get()
+          self.centringStatus = self.centringStatus.updated(images=snapshotsProcedure.get())
 
  
     def snapshotsDone(self, snapshotsProcedure):
         self.camera.forceUpdate = False
         
         try:
-           self.centringStatus["images"] = snapshotsProcedure.get()
+           self.centringStatus = self.centringStatus.updated(images=snapshotsProcedure.get())
         except:
            logging.getLogger("HWR").exception("MiniDiff: could not take crystal snapshots")
            self.emit('centringSnapshots', (False,))
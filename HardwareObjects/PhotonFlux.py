@@ -5,6 +5,9 @@ import logging
 class PhotonFlux(Equipment):
     def __init__(self, *args, **kwargs):
         Equipment.__init__(self, *args, **kwargs)
+        self._calib_energies = None
+        self._calib_counts = None
+        self._energy = None
 
     def init(self):
         self.read_counts_chan = self.getChannelObject("counts")
@@ -23,6 +26,8 @@ class PhotonFlux(Equipment):
         else:
           self.index = 1
 
+        self.calibration_chan.connectSignal("update", self.calibrationChanged)
+        self.connect(self.energy_motor, "positionChanged", self.energyChanged)
         self.read_counts_chan.connectSignal("update", self.countsUpdated) 
         self.getChannelObject("flag").connectSignal("update", self.updateFlux)
         self.shutter.connect("shutterStateChanged", self.shutterStateChanged)
@@ -47,35 +52,58 @@ class PhotonFlux(Equipment):
         except TypeError:
           logging.getLogger("HWR").error("%s: counts is None", self.name())
           return
-        flux = None
+        egy = self._energy
+        if egy is None:
+          try:
+            egy = self.energy_motor.getPosition()
+          except:
+            logging.getLogger("HWR").exception("%s: could not get energy", self.name())
+            return
+          self._energy = egy
 
-        try:
-          egy = self.energy_motor.getPosition()*1000.0
-        except:
-          logging.getLogger("HWR").exception("%s: could not get energy", self.name())
-        else:
+        flux = self.flux_for_energies([egy])
+        if flux is None:
+          return
+        flux = counts * flux[0]
+        #logging.getLogger("HWR").debug("%s: flux-> %f", self.name(), flux)
+        self.emitValueChanged("%1.3g" % flux)
+
+    def energyChanged(self, pos):
+        self._energy = pos
+
+    def calibrationChanged(self, _):
+        self._calib_energies = None
+        self._calib_counts = None
+
+    def _getCalibration(self):
+        if self._calib_energies is None:
           try:
             calib_dict = self.calibration_chan.getValue()
             if calib_dict is None:
               logging.getLogger("HWR").error("%s: calibration is None", self.name())
-            else:
-              calibs = [(float(c["energy"]), float(c[self.counter])) for c in calib_dict.itervalues()]
-              calibs.sort()
-              E = [c[0] for c in calibs]
-              C = [c[1] for c in calibs]
+              return None
+            calibs = numpy.array([(float(c["energy"]), float(c[self.counter])) for c in calib_dict.itervalues()])
+            order = calibs[:, 0].argsort()
+            self._calib_energies = calibs[order, 0]
+            self._calib_counts = calibs[order, 1]
           except:
             logging.getLogger("HWR").exception("%s: could not get calibration", self.name())
-          else:
-            try:
-              aperture_coef = self.aperture.getApertureCoef()
-            except:
-              aperture_coef = 1
-            if aperture_coef <= 0:
-              aperture_coef = 1
-            calib = numpy.interp([egy], E, C)
-            flux = counts * calib * aperture_coef
-            #logging.getLogger("HWR").debug("%s: flux-> %f * %f=%f , calib_dict=%r", self.name(), counts, calib, counts*calib, calib_dict)
-            self.emitValueChanged("%1.3g" % flux)
+            return None
+        return self._calib_energies, self._calib_counts
+
+    def flux_for_energies(self, energies):
+        """Return flux per count for each energy (keV), or None if no calibration"""
+        calib = self._getCalibration()
+        if calib is None:
+          return None
+        try:
+          aperture_coef = self.aperture.getApertureCoef()
+        except:
+          aperture_coef = 1
+        if aperture_coef <= 0:
+          aperture_coef = 1
+        energies = numpy.asarray(energies, dtype=float) * 1000.0
+        return numpy.interp(energies, calib[0], calib[1]) * aperture_coef
 
     def getCurrentFlux(self):
         return self.current_flux
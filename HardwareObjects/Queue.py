@@ -15,6 +15,7 @@ import queue_entry
 from HardwareRepository.TaskUtils import task
 from HardwareRepository.BaseHardwareObjects import HardwareObject
 from queue_entry import QueueEntryContainer
+from mount_scheduler import MountScheduler
 
 __author__ = "Marcus Oskarsson"
 __copyright__ = "Copyright 2012, ESRF"
@@ -51,6 +52,11 @@ class Queue(HardwareObject, QueueEntryContainer):
         self._current_queue_entry = None
         self._running = False
         self._disable_collect = False
+        self.mount_scheduler = MountScheduler()
+
+    def init(self):
+        self.mount_scheduler.optimise_order = \
+            bool(self.getProperty("optimise_mount_order"))
 
     def enqueue(self, queue_entry):
         """
@@ -95,7 +101,16 @@ class Queue(HardwareObject, QueueEntryContainer):
     def __execute_task(self):
         self._running = True
 
-        for qe in self._queue_entry_list:
+        # Samples are executed in the order given by the mount scheduler
+        try:
+            sample_changer = self.getObjectByRole("beamline_setup").\
+                             sample_changer_hwobj
+        except AttributeError:
+            sample_changer = None
+        entries = self.mount_scheduler.schedule(self._queue_entry_list,
+                                                sample_changer)
+
+        for qe in entries:
             try:
                 self.__execute_entry(qe)
             except (queue_entry.QueueAbortedException, Exception) as ex:
@@ -303,6 +318,7 @@ class Queue(HardwareObject, QueueEntryContainer):
         :returns: None
         :rtype: NoneType
         """
+        self.mount_scheduler.clear()
         self.__execute_entry(entry)
 
     def clear(self):
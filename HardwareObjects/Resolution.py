@@ -1,6 +1,7 @@
 from HardwareRepository import BaseHardwareObjects
 import logging
 import math
+import numpy
 
 
 class Resolution(BaseHardwareObjects.Equipment):
@@ -23,6 +24,9 @@ class Resolution(BaseHardwareObjects.Equipment):
    	self.detector_diameter_chan = self.addChannel({"type":"spec", "version": self.getradius.specVersion, "name":"detector_radius"}, "MXBCM_PARS/detector_radius")
         self.detector_diameter = 0
         self.det_radius = 0
+        self.beam_centre = None
+        self._limits_table = None
+        self.limits_table_size = int(self.getProperty("limits_table_size") or 101)
 
         if self.wavelength is None:
           self.energy = self.getDeviceByRole("energy")
@@ -35,6 +39,7 @@ class Resolution(BaseHardwareObjects.Equipment):
 
         self.connect(self.detm, "stateChanged", self.detmStateChanged)
         self.connect(self.detm, "positionChanged", self.detmPositionChanged) 
+        self.connect(self.detm, "limitsChanged", self.detmLimitsChanged)
         if self.wavelength is not None:
           self.connect(self.wavelength, "positionChanged", self.wavelengthChanged)
         else:
@@ -57,6 +62,8 @@ class Resolution(BaseHardwareObjects.Equipment):
         x = float(beam_pos_dict["x"])
         y = float(beam_pos_dict["y"])
         self.det_radius =  min(self.detector_diameter - x, self.detector_diameter - y, x, y)
+        self.beam_centre = (x, y)
+        self._limits_table = None
 
     def getWavelength(self):
         if self.wavelength is None:
@@ -71,39 +78,81 @@ class Resolution(BaseHardwareObjects.Equipment):
         if pos is None:
            pos = self.getWavelength()
         self.current_wavelength = pos
+        self._limits_table = None
         self.recalculateResolution()      
 
     def energyChanged(self, energy):
         self.wavelengthChanged(12.3984/energy)
  
-    def res2dist(self, res=None):
-        self.current_wavelength = self.getWavelength()
+    def _getCachedWavelength(self):
+        if not self.current_wavelength:
+            self.current_wavelength = self.getWavelength()
+        return self.current_wavelength
 
+    def res2dist(self, res=None, radius=None):
+        """Detector distance(s) for resolution(s) in A; arrays give arrays, with nan where undefined"""
         if res is None:
             res = self.currentResolution
+        if radius is None:
+            radius = self.det_radius
 
         try:
-            ttheta = 2*math.asin(self.current_wavelength / (2*res))
-            return self.det_radius / math.tan(ttheta)
+            if numpy.ndim(res) == 0:
+                ttheta = 2*math.asin(self._getCachedWavelength() / (2*res))
+                return radius / math.tan(ttheta)
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                ttheta = 2*numpy.arcsin(self._getCachedWavelength() / (2*numpy.asarray(res, dtype=float)))
+                return radius / numpy.tan(ttheta)
         except:
             return None
 
-    def dist2res(self, dist=None):
-        
+    def dist2res(self, dist=None, radius=None):
+        """Resolution(s) in A for detector distance(s); arrays give arrays, with nan where undefined"""
         if dist is None:
             dist = self.dtox.getPosition()
+        if radius is None:
+            radius = self.det_radius
             
         try:
-            ttheta = math.atan(self.det_radius / dist)
+            if numpy.ndim(dist) == 0:
+                ttheta = math.atan(radius / dist)
             
-            if ttheta != 0:
-                return self.current_wavelength / (2*math.sin(ttheta/2))
-            else:
-                return None
+                if ttheta != 0:
+                    return self._getCachedWavelength() / (2*math.sin(ttheta/2))
+                else:
+                    return None
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                ttheta = numpy.arctan(radius / numpy.asarray(dist, dtype=float))
+                return numpy.where(ttheta != 0, self._getCachedWavelength() / (2*numpy.sin(ttheta/2)), numpy.nan)
         except:
             logging.getLogger().exception("error while calculating resolution")
             return None
 
+    def getCornerRadius(self):
+        if self.beam_centre is None:
+            return None
+        x, y = self.beam_centre
+        return math.hypot(max(x, self.detector_diameter - x), max(y, self.detector_diameter - y))
+
+    def getCornerResolution(self, dist=None):
+        """Resolution(s) reached in the detector corner for detector distance(s)"""
+        radius = self.getCornerRadius()
+        if radius is None:
+            return None
+        return self.dist2res(dist, radius=radius)
+
+    def getLimitsTable(self):
+        """(distances, edge resolutions, corner resolutions) sampled over the detector distance range"""
+        if self._limits_table is None:
+            low, high = self.detm.getLimits()
+            distances = numpy.linspace(low, high, self.limits_table_size)
+            corner = self.getCornerResolution(distances)
+            if corner is None:
+                corner = numpy.empty_like(distances)
+                corner.fill(numpy.nan)
+            self._limits_table = (distances, self.dist2res(distances), corner)
+        return self._limits_table
+
     def recalculateResolution(self):
         new_res = self.dist2res(self.dtox.getPosition())
         if new_res is None:
@@ -156,13 +205,17 @@ class Resolution(BaseHardwareObjects.Equipment):
         else:
           self.detmStateChanged(self.detm.READY)
 
+    def detmLimitsChanged(self, limits=None):
+        self._limits_table = None
+
     def getLimits(self, callback=None, error_callback=None):
-        low, high = self.detm.getLimits()
+        resolutions = self.getLimitsTable()[1]
+        limits = (float(resolutions[0]), float(resolutions[-1]))
        
         if callable(callback):
-            callback((self.dist2res(low), self.dist2res(high)))
+            callback(limits)
         else:    
-            return (self.dist2res(low), self.dist2res(high))
+            return limits
 
     def move(self, pos, wait=True):
 	logging.getLogger().info("move Resolution to %s", pos)
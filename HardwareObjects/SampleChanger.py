@@ -393,7 +393,8 @@ class SampleChanger(Equipment):
 
         logging.info("%s: scanning basket %s", self.name(), basket)
         
-        self.scannedMatrices=[]
+        # forget the previous results for this basket only
+        self.setBasketMatrices(basket, [])
         ret = self.executeJavaDeviceServerTask("ScanBasketForDatamatrix", basket, wait=wait)
         if not wait:
           ret.link(self.displayErrorFromSampleChangerTask)
@@ -405,26 +406,62 @@ class SampleChanger(Equipment):
         basket_presence = self.isScanBasketForDataMatrixDone()
         self.emit("basketPresenceChanged", (basket_presence, ))
         
+        # the results of each basket are read in a thread of the gevent
+        # threadpool, while the next basket is being scanned
+        threadpool = gevent.get_hub().threadpool
+        scanned_basket, basket_matrices = None, None
         i = 0
         for scan in baskets_to_scan:
             i+=1
             if scan == 1:
                 self.scanBasket(i, wait=True)                
                 logging.info("%s: basket %s scanned", self.name(), i)
+                if scanned_basket is not None:
+                    self.basketScanned(scanned_basket, basket_matrices.get())
+                scanned_basket, basket_matrices = i, threadpool.spawn(self.readBasketMatrices, i)
 
             if self.stopScanAllBasketsFlag:
                 raise Exception("Scan stopped")
 
+        if scanned_basket is not None:
+            self.basketScanned(scanned_basket, basket_matrices.get())
+
         logging.info("%s: basket(s) scan done", self.name())
         
-        matrices=self.getMatrixCodes(force=True)
+        # read everything again: scanning also changes the flags of the
+        # samples of the other baskets
+        self.updateDataMatrices()
+        matrices=self.getMatrixCodes()
         if callable(scanFinishedCallback):
             scanFinishedCallback(matrices)
-        self.updateDataMatrices()
 
         self.stopScanAllBasketsFlag = None
 
 
+    def readBasketMatrices(self, basket):
+        """Read the scan results of a basket from the device server; can be called from another thread"""
+        device = PyTango.DeviceProxy(self.getProperty("tangoname"))
+        sc_xml = device.GetInformationAsXml()
+        if sc_xml is None:
+            return []
+        return [m for m in getDataMatricesList(sc_xml) if m[1] == basket]
+
+
+    def basketScanned(self, basket, basket_matrices):
+        """Keep and emit the results of a basket scan, and update the other matrix codes listeners"""
+        self.setBasketMatrices(basket, basket_matrices)
+        self.emit("basketScanned", (basket, basket_matrices))
+        self.updateDataMatrices(force=False)
+
+
+    def setBasketMatrices(self, basket, basket_matrices):
+        if self.scannedMatrices is None:
+            return
+        matrices = [m for m in self.scannedMatrices if m[1] != basket] + list(basket_matrices)
+        matrices.sort(key=lambda m: (m[1], m[2]))
+        self.scannedMatrices = matrices
+
+
     def scanAllBaskets(self, scanFinishedCallback=None, failureCallback=None):
         return self.scanBaskets([1,1,1,1], scanFinishedCallback, failureCallback)
 
@@ -467,8 +504,9 @@ class SampleChanger(Equipment):
 
         self.scanCurrentBasketProcedure = None
 
-        matrices=self.getMatrixCodes(force=True)
         self.updateDataMatrices()
+        matrices=self.getMatrixCodes()
+        self.emit("basketScanned", (basket, [m for m in matrices if m[1] == basket]))
         if callable(scanFinishedCallback):
             scanFinishedCallback(matrices)
             
@@ -805,8 +843,8 @@ class SampleChanger(Equipment):
             lightDevice.wagoIn()
 
 
-    def updateDataMatrices(self,old={"matrices":None}):
-        matrices = self.getMatrixCodes(force=True)
+    def updateDataMatrices(self,old={"matrices":None},force=True):
+        matrices = self.getMatrixCodes(force=force)
         logging.getLogger("HWR").debug("%s: data matrices updated: %s", self.name(), matrices)
 
         loaded_sample_barcode = self.getLoadedSampleDataMatrix()
@@ -11,11 +11,16 @@ import inspect
 import pkgutil
 import types
 import gevent
+import gevent.pool
 import socket
+import itertools
+import xmlrpclib
+import time
 
 
 from HardwareRepository.BaseHardwareObjects import HardwareObject
 from SimpleXMLRPCServer import SimpleXMLRPCServer
+from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
 
 
 __author__ = "Marcus Oskarsson, Matias Guijarro"
@@ -28,6 +33,69 @@ __email__ = "marcus.oscarsson@esrf.fr"
 __status__ = "Draft"
 
 
+class KeepAliveXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
+    """
+    Request handler speaking HTTP/1.1, so that clients can keep their
+    connection open and send several requests over it. Connections idle
+    for more than the idle_timeout of the server are closed.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        self.timeout = getattr(self.server, "idle_timeout", None)
+        SimpleXMLRPCRequestHandler.setup(self)
+
+
+class ConcurrentXMLRPCServer(SimpleXMLRPCServer):
+    """
+    SimpleXMLRPCServer handling each connection in its own greenlet, so
+    that a slow call does not block the others. Each call is aborted
+    after <call_timeout> seconds (no timeout if None), connections are
+    closed after <idle_timeout> seconds without request.
+    """
+    def __init__(self, addr, max_connections=None, call_timeout=None,
+                 idle_timeout=60, **kwargs):
+        kwargs.setdefault("requestHandler", KeepAliveXMLRPCRequestHandler)
+        SimpleXMLRPCServer.__init__(self, addr, **kwargs)
+        self.call_timeout = call_timeout
+        self.idle_timeout = idle_timeout
+        self._connections = gevent.pool.Pool(max_connections)
+
+    def process_request(self, request, client_address):
+        self._connections.spawn(self._process_request, request,
+                                client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def _dispatch(self, method, params):
+        if self.call_timeout is None:
+            return SimpleXMLRPCServer._dispatch(self, method, params)
+
+        timeout = gevent.Timeout(self.call_timeout)
+        timeout.start()
+        try:
+            return SimpleXMLRPCServer._dispatch(self, method, params)
+        except gevent.Timeout as t:
+            if t is not timeout:
+                # a timeout of the hardware call itself
+                raise
+            msg = "%s did not complete within %s s" % (method,
+                                                      self.call_timeout)
+            raise xmlrpclib.Fault(1, msg)
+        finally:
+            timeout.cancel()
+
+    def server_close(self):
+        self._connections.kill()
+        SimpleXMLRPCServer.server_close(self)
+
+
 class XMLRPCServer(HardwareObject):
     def __init__(self, name):
         HardwareObject.__init__(self, name)
@@ -38,6 +106,11 @@ class XMLRPCServer(HardwareObject):
         self.xmlrpc_prefixes = set()
         self.current_entry_task = None
         self.host = None
+        self._tasks = {}
+        self._task_end_times = {}
+        self._task_ids = itertools.count(1)
+        # finished tasks are forgotten after this many seconds
+        self.task_retention = 600
       
     def init(self):
         """
@@ -60,6 +133,11 @@ class XMLRPCServer(HardwareObject):
         
 
     def close(self):
+        for task in self._tasks.itervalues():
+            task.kill(block = False)
+        self._tasks = {}
+        self._task_end_times = {}
+
         try:
           self.xmlrpc_server_task.kill()
           self._server.server_close()
@@ -71,18 +149,50 @@ class XMLRPCServer(HardwareObject):
         # The value of the member self.port is set in the xml configuration
         # file. The initialization is done by the baseclass HardwareObject.
         self.xmlrpc_prefixes = set()
-        self._server = SimpleXMLRPCServer((self.host, int(self.port)), logRequests = False)
+
+        if self.getProperty("task_retention") is not None:
+            self.task_retention = float(self.getProperty("task_retention"))
+
+        # <concurrent>True</concurrent> handles requests in parallel, over
+        # keep-alive connections, and aborts calls taking more than
+        # <call_timeout> seconds
+        if self.getProperty("concurrent"):
+            call_timeout = self.getProperty("call_timeout")
+            if call_timeout is not None:
+                call_timeout = float(call_timeout)
+
+            max_connections = self.getProperty("max_connections")
+            if max_connections is not None:
+                max_connections = int(max_connections)
+
+            idle_timeout = self.getProperty("idle_timeout")
+            if idle_timeout is None:
+                idle_timeout = 60
+
+            self._server = ConcurrentXMLRPCServer((self.host, int(self.port)),
+                                                  max_connections = max_connections,
+                                                  call_timeout = call_timeout,
+                                                  idle_timeout = float(idle_timeout),
+                                                  logRequests = False,
+                                                  allow_none = True)
+        else:
+            self._server = SimpleXMLRPCServer((self.host, int(self.port)), logRequests = False)
 
         msg = 'XML-RPC server listening on: %s:%s' % (self.host, self.port)
         logging.getLogger("HWR").info(msg)
 
         self._server.register_introspection_functions()
+        self._server.register_multicall_functions()
         self._server.register_function(self.start_queue)
         self._server.register_function(self.log_message)
         self._server.register_function(self.is_queue_executing)
         self._server.register_function(self.queue_execute_entry_with_id)
         self._server.register_function(self.shape_history_get_grid)
         self._server.register_function(self.beamline_setup_read)
+        self._server.register_function(self.beamline_setup_read_values)
+        self._server.register_function(self.task_start)
+        self._server.register_function(self.task_status)
+        self._server.register_function(self.task_result)
 
         # Register functions from modules specified in <apis> element
         if self.hasObject("apis"):
@@ -268,6 +378,91 @@ class XMLRPCServer(HardwareObject):
             logging.getLogger('HWR').exception(str(ex))
             raise
 
+    def beamline_setup_read_values(self, paths):
+        try:
+            return self.beamline_setup_hwobj.read_values(paths)
+        except Exception as ex:
+            logging.getLogger('HWR').exception(str(ex))
+            raise
+
+    def task_start(self, method_name, params = ()):
+        """
+        Starts the registered XML-RPC function <method_name> in the
+        background and returns immediately. The result can later be
+        retrieved with task_status and task_result.
+
+        :param method_name: The XML-RPC name of the function to call.
+        :type method_name: str
+
+        :param params: The parameters of the call.
+        :type params: list
+
+        :returns: The id of the started task.
+        :rtype: int
+        """
+        if method_name.startswith("task_") or \
+               method_name.startswith("system."):
+            raise ValueError("%s cannot be started as a task" % method_name)
+
+        self._reap_tasks()
+
+        # tasks are not subject to the per-call timeout
+        task_id = self._task_ids.next()
+        task = gevent.spawn(SimpleXMLRPCServer._dispatch, self._server,
+                            method_name, tuple(params))
+        task.link(lambda t: self._task_end_times.__setitem__(task_id,
+                                                             time.time()))
+        self._tasks[task_id] = task
+        return task_id
+
+    def _reap_tasks(self):
+        """
+        Forgets the tasks finished for more than task_retention seconds
+        whose result was never collected.
+        """
+        limit = time.time() - self.task_retention
+        for task_id, end_time in self._task_end_times.items():
+            if end_time < limit:
+                del self._task_end_times[task_id]
+                self._tasks.pop(task_id, None)
+
+    def task_status(self, task_id):
+        """
+        :returns: 'running', 'done' or 'failed'
+        :rtype: str
+        """
+        task = self._get_task(task_id)
+
+        if not task.ready():
+            return 'running'
+        elif task.successful():
+            return 'done'
+        else:
+            return 'failed'
+
+    def task_result(self, task_id):
+        """
+        Returns the result of the finished task <task_id> and forgets
+        about it. The exception raised by the task, if any, is sent to
+        the client.
+
+        :returns: The return value of the function called by the task.
+        """
+        task = self._get_task(task_id)
+
+        if not task.ready():
+            raise RuntimeError("Task %d is still running" % task_id)
+
+        del self._tasks[task_id]
+        self._task_end_times.pop(task_id, None)
+        return task.get(block = False)
+
+    def _get_task(self, task_id):
+        try:
+            return self._tasks[task_id]
+        except KeyError:
+            raise ValueError("Unknown task id %r" % task_id)
+
     def workflow_set_in_progress(self, state):
         if state:
             self.wokflow_in_progress = True
@@ -5,6 +5,7 @@ import os
 import time
 import types
 import gevent
+import file_numbering
 
 class XfeSpectrum(Equipment):
     def init(self):
@@ -121,16 +122,9 @@ class XfeSpectrum(Equipment):
         filename_pattern = os.path.extsep.join((filename_pattern, "dat"))
         html_pattern = os.path.extsep.join((aname_pattern, "html"))
         aname_pattern = os.path.extsep.join((aname_pattern, "png"))
-        filename = filename_pattern % 1
-        aname = aname_pattern % 1
-        htmlname = html_pattern % 1
-
-        i = 2
-        while os.path.isfile(filename):
-            filename = filename_pattern % i
-            aname = aname_pattern % i
-            htmlname = html_pattern % i
-            i=i+1
+        i, filename = file_numbering.reserve_filename(filename_pattern)
+        aname = aname_pattern % i
+        htmlname = html_pattern % i
 
         self.spectrumInfo["filename"] = filename
         #self.spectrumInfo["scanFileFullPath"] = filename
@@ -148,6 +142,7 @@ class XfeSpectrum(Equipment):
             res = self.doSpectrum(ct, filename, wait=True)
         except:
             logging.getLogger().exception('XRFSpectrum: problem calling spec macro')
+            file_numbering.release_filename(filename)
             self.emit('spectrumStatusChanged', ("Error problem spec macro",))
         else:
             self.spectrumCommandFinished(res)
@@ -172,11 +167,15 @@ class XfeSpectrum(Equipment):
     def spectrumCommandFailed(self, *args):
         self.spectrumInfo['endTime']=time.strftime("%Y-%m-%d %H:%M:%S")
         self.scanning = False
+        if self.spectrumInfo.get("filename"):
+            file_numbering.release_filename(self.spectrumInfo["filename"])
         self.storeXfeSpectrum()
         self.emit('xfeSpectrumFailed', ())
     
     def spectrumCommandAborted(self, *args):
         self.scanning = False
+        if self.spectrumInfo and self.spectrumInfo.get("filename"):
+            file_numbering.release_filename(self.spectrumInfo["filename"])
         self.emit('xfeSpectrumFailed', ())
 
     def spectrumCommandFinished(self,result):
@@ -0,0 +1,81 @@
+"""
+Centring geometry
+
+A point of the sample seen at phi angles theta_i is at (x_i, y_i) on the
+sample video: x, along the rotation axis, does not depend on the angle, y
+follows y_c + a.cos(theta) + b.sin(theta). fit_rotation() fits any number
+(at least 3) of such observations by least squares, flags the outliers and
+refits without them; centring_offsets() turns the fit into motor moves.
+"""
+import math
+import collections
+import numpy
+
+__all__ = ["CentringFit", "fit_rotation", "centring_offsets"]
+
+CentringFit = collections.namedtuple("CentringFit", "xc yc a b rms condition outliers")
+CentringFit.__doc__ = """Result of fit_rotation
+
+xc, yc: position of the rotation axis on the image (pixels)
+a, b: cos and sin amplitudes of the vertical motion (pixels)
+rms: rms distance of the observations to the fit (pixels), 0 if there is no redundancy
+condition: condition number of the fit, large when the angles are badly spread
+outliers: boolean array, observations excluded from the fit
+"""
+
+
+def _fit(theta, x, y):
+    design = numpy.column_stack((numpy.ones_like(theta), numpy.cos(theta), numpy.sin(theta)))
+    (yc, a, b), _, _, singular_values = numpy.linalg.lstsq(design, y, rcond=-1)
+    xc = x.mean()
+    residuals = numpy.hypot(x - xc, y - design.dot((yc, a, b)))
+    return xc, yc, a, b, residuals, singular_values[0] / singular_values[-1]
+
+
+def fit_rotation(angles, x, y, outlier_threshold=3.0, min_residual=2.0):
+    """Fit observations at angles (degrees) and image positions x, y (pixels)
+
+    Observations further from the fit than outlier_threshold times the
+    robust standard deviation of the residuals (and than min_residual
+    pixels) are flagged as outliers, as long as 4 observations remain.
+    """
+    theta = numpy.radians(numpy.asarray(angles, numpy.float64))
+    x = numpy.asarray(x, numpy.float64)
+    y = numpy.asarray(y, numpy.float64)
+    if len(theta) < 3 or not (len(theta) == len(x) == len(y)):
+        raise ValueError("centring needs at least 3 (angle, x, y) observations")
+
+    outliers = numpy.zeros(len(theta), numpy.bool_)
+    while True:
+        used = ~outliers
+        xc, yc, a, b, residuals, condition = _fit(theta[used], x[used], y[used])
+        if used.sum() <= 4:
+            break
+        all_residuals = numpy.hypot(x - xc, y - (yc + a * numpy.cos(theta) + b * numpy.sin(theta)))
+        sigma = 1.4826 * numpy.median(residuals)
+        worst = numpy.argmax(numpy.where(used, all_residuals, -1))
+        if all_residuals[worst] <= max(outlier_threshold * sigma, min_residual):
+            break
+        outliers[worst] = True
+
+    if used.sum() > 3:
+        rms = math.sqrt(numpy.mean(residuals ** 2))
+    else:
+        rms = 0.0
+    return CentringFit(xc, yc, a, b, rms, condition, outliers)
+
+
+def centring_offsets(fit, phi_dial_position, pixels_per_mm_y, pixels_per_mm_z, img_width, img_height, phiy_direction=1):
+    """Moves (sampx, sampy, phiy, phiz), in mm, bringing the fitted point to the beam
+
+    The angles of the fit are relative to the first observation, taken
+    at phi_dial_position.
+    """
+    b1 = -math.radians(phi_dial_position)
+    # offset of the point from the rotation axis, in the sample table frame
+    x, y = -fit.b, fit.a
+    dx = (x * math.cos(b1) + y * math.sin(b1)) / pixels_per_mm_y
+    dy = (y * math.cos(b1) - x * math.sin(b1)) / pixels_per_mm_y
+    dphiy = phiy_direction * (fit.xc - img_width / 2) / float(pixels_per_mm_y)
+    dphiz = (fit.yc - img_height / 2) / float(pixels_per_mm_z)
+    return dx, dy, dphiy, dphiz
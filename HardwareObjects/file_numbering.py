@@ -0,0 +1,86 @@
+"""
+Sequence numbers for numbered result files
+
+A filename pattern is a path containing one integer conversion, for example
+"/data/pyarch/.../prefix_12_Mar_2013_%02d.dat". The directory is listed once
+per pattern to find the highest index in use; after that the highest index
+is kept in memory and each new number is reserved by creating the file with
+O_EXCL, so concurrent writers never get the same file. A reserved file
+that could not be written is removed with release_filename().
+"""
+import os
+import re
+import errno
+import threading
+
+__all__ = ["reserve_filename", "release_filename", "forget"]
+
+_INDEX_CONVERSION = re.compile(r"%0?\d*d")
+
+_lock = threading.Lock()
+_last_index = {}
+
+
+def _pattern_regex(basename_pattern):
+    parts = _INDEX_CONVERSION.split(basename_pattern)
+    if len(parts) != 2:
+        raise ValueError("filename pattern must contain exactly one integer conversion: %r" % basename_pattern)
+    return re.compile(r"^%s(\d+)%s$" % (re.escape(parts[0]), re.escape(parts[1])))
+
+
+def _highest_index(pattern):
+    directory, basename_pattern = os.path.split(pattern)
+    regex = _pattern_regex(basename_pattern)
+    try:
+        filenames = os.listdir(directory or os.curdir)
+    except OSError:
+        return 0
+    highest = 0
+    for filename in filenames:
+        match = regex.match(filename)
+        if match:
+            highest = max(highest, int(match.group(1)))
+    return highest
+
+
+def reserve_filename(pattern, start=1):
+    """Reserve the next free index for pattern; returns (index, filename)
+
+    The reserved file is created empty, the caller is expected to overwrite it
+    or to give it back with release_filename() on failure.
+    """
+    with _lock:
+        index = _last_index.get(pattern)
+        if index is None:
+            index = _highest_index(pattern)
+        index = max(index + 1, start)
+        while True:
+            filename = pattern % index
+            try:
+                fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+            except OSError, err:
+                if err.errno != errno.EEXIST:
+                    raise
+                index += 1
+            else:
+                os.close(fd)
+                _last_index[pattern] = index
+                return index, filename
+
+
+def release_filename(filename):
+    """Remove a reserved file if nothing has been written to it"""
+    try:
+        if os.path.getsize(filename) == 0:
+            os.remove(filename)
+    except OSError:
+        pass
+
+
+def forget(pattern=None):
+    """Drop the cached index for pattern (or for all patterns)"""
+    with _lock:
+        if pattern is None:
+            _last_index.clear()
+        else:
+            _last_index.pop(pattern, None)
@@ -0,0 +1,129 @@
+"""
+Notification when a result file has been completely written
+
+wait_file_ready() starts a worker thread which waits for the file to be
+closed by its writer (inotify close-write/moved-to events when pyinotify is
+available, otherwise by polling until size and modification time are stable),
+optionally parses it on the same thread, and delivers the outcome through a
+gevent AsyncResult set from the hub.
+"""
+import os
+import sys
+import time
+import threading
+import gevent
+import gevent.event
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+__all__ = ["wait_file_ready", "FileNotReady"]
+
+
+class FileNotReady(RuntimeError):
+    pass
+
+
+class FileReadyThread(threading.Thread):
+    def __init__(self, path, parse=None, timeout=None, stable_time=0.1):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+
+        self.path = os.path.abspath(path)
+        self.parse = parse
+        self.timeout = timeout
+        self.stable_time = stable_time
+        self._value = None
+        self._exception = None
+
+    def start(self):
+        self.result = gevent.event.AsyncResult()
+        self._watcher = gevent.get_hub().loop.async()
+        self._watcher.start(self._deliver)
+        threading.Thread.start(self)
+        return self.result
+
+    def _deliver(self):
+        self._watcher.stop()
+        if self._exception is not None:
+            self.result.set_exception(self._exception)
+        else:
+            self.result.set(self._value)
+
+    def _deadline(self):
+        if self.timeout is None:
+            return None
+        return time.time() + self.timeout
+
+    def _wait_stable(self, deadline):
+        last = None
+        while True:
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                current = None
+            else:
+                current = (st.st_size, st.st_mtime)
+                if current == last and st.st_size > 0:
+                    return True
+            last = current
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(self.stable_time)
+
+    def _wait_inotify(self, deadline):
+        directory, filename = os.path.split(self.path)
+        closed = []
+
+        def file_event(event):
+            if event.name == filename:
+                closed.append(event)
+
+        wm = pyinotify.WatchManager()
+        notifier = pyinotify.Notifier(wm, file_event)
+        try:
+            wm.add_watch(directory, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+            if os.path.exists(self.path):
+                # written (or being written) before the watch was set up
+                return self._wait_stable(deadline)
+            while not closed:
+                if deadline is None:
+                    check_timeout = 1000
+                else:
+                    check_timeout = int((deadline - time.time()) * 1000)
+                    if check_timeout <= 0:
+                        return False
+                if notifier.check_events(check_timeout):
+                    notifier.read_events()
+                    notifier.process_events()
+            return True
+        finally:
+            notifier.stop()
+
+    def run(self):
+        try:
+            deadline = self._deadline()
+            if pyinotify is not None and os.path.isdir(os.path.dirname(self.path)):
+                ready = self._wait_inotify(deadline)
+            else:
+                ready = self._wait_stable(deadline)
+            if not ready:
+                raise FileNotReady("Timeout waiting for %s" % self.path)
+            if callable(self.parse):
+                self._value = self.parse(self.path)
+            else:
+                self._value = self.path
+        except:
+            self._exception = sys.exc_info()[1]
+        self._watcher.send()
+
+
+def wait_file_ready(path, parse=None, timeout=None, stable_time=0.1):
+    """Return an AsyncResult set to parse(path) (or path) once the file is complete
+
+    The AsyncResult gets a FileNotReady exception if the file is not
+    complete after timeout seconds, or the exception raised by parse.
+    """
+    return FileReadyThread(path, parse, timeout, stable_time).start()
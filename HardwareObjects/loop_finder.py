@@ -0,0 +1,141 @@
+"""
+Loop finding in worker processes
+
+lucid.find_loop is CPU-bound: LoopFinderPool runs it in a pool of worker
+processes, so that the control process keeps servicing motors and devices
+while images are analysed, and several images can be analysed at the same
+time. find_loop() returns at once with a gevent AsyncResult; frames from a
+shared VideoFrameBus are passed to the workers by id, other frames are sent
+as strings.
+
+The workers are forked by start() only, which should be called as early
+as possible; with processes=0 there are no workers and frames are analysed
+in the calling process. Workers killed after a timeout are not replaced:
+loop finding then fails until start() is called again.
+"""
+import os
+import sys
+import tempfile
+import traceback
+import multiprocessing
+import gevent
+import gevent.event
+import Image
+
+try:
+    import lucid
+except ImportError:
+    lucid = None
+
+__all__ = ["LoopFinderPool", "LoopFinderError"]
+
+
+class LoopFinderError(RuntimeError):
+    pass
+
+
+_video_bus = None
+
+def _init_worker(video_bus):
+    global _video_bus
+    _video_bus = video_bus
+
+
+def _find_loop(frame, size, pixels_per_mm_horizontal):
+    # frame is a frame id on the shared video bus, or the RGB data
+    try:
+        if isinstance(frame, (int, long)):
+            shared_frame = _video_bus.get(frame)
+            if shared_frame is None:
+                raise LoopFinderError("frame %d has been overwritten" % frame)
+            data = shared_frame.image.tostring()
+            if not _video_bus.is_current(shared_frame):
+                raise LoopFinderError("frame %d has been overwritten" % frame)
+        else:
+            data = frame
+        snapshot_filename = os.path.join(tempfile.gettempdir(), "mxcube_sample_snapshot_%d.png" % os.getpid())
+        Image.fromstring("RGB", size, data).save(snapshot_filename)
+        return True, lucid.find_loop(snapshot_filename, pixels_per_mm_horizontal=pixels_per_mm_horizontal)
+    except:
+        return False, "".join(traceback.format_exception(*sys.exc_info()))
+
+
+class LoopFinderPool:
+    def __init__(self, processes=0, video_bus=None, timeout=None):
+        """video_bus: a shared VideoFrameBus, if frames are to be read from it by the workers"""
+        self.processes = processes
+        self.video_bus = video_bus
+        self.timeout = timeout
+        self._pool = None
+        self._pending = set()
+
+    def start(self):
+        if self._pool is None and self.processes > 0:
+            self._pool = multiprocessing.Pool(self.processes, _init_worker, (self.video_bus,))
+
+    def terminate(self):
+        """Kill the workers; the analyses in progress fail at once"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        pending = list(self._pending)
+        self._pending.clear()
+        for result in pending:
+            result.set_exception(LoopFinderError("loop finding workers terminated"))
+
+    def find_loop(self, frame, pixels_per_mm_horizontal):
+        """Start the analysis of frame (a VideoFrameBus Frame), return an AsyncResult set to (info, x, y)"""
+        if lucid is None:
+            raise LoopFinderError("lucid cannot load: loop finding is disabled")
+        height, width = frame.image.shape[:2]
+        result = gevent.event.AsyncResult()
+
+        if self.processes <= 0:
+            ok, value = _find_loop(frame.image.tostring(), (width, height), pixels_per_mm_horizontal)
+            if ok:
+                result.set(value)
+            else:
+                result.set_exception(LoopFinderError(value))
+            return result
+        if self._pool is None:
+            raise LoopFinderError("loop finding workers are not running")
+
+        if self.video_bus is not None and self.video_bus.get(frame.id) is not None:
+            data = frame.id
+        else:
+            data = frame.image.tostring()
+
+        outcome = []
+        watcher = gevent.get_hub().loop.async()
+
+        def deliver():
+            watcher.stop()
+            if result not in self._pending:
+                # failed by terminate()
+                return
+            self._pending.discard(result)
+            ok, value = outcome[0]
+            if ok:
+                result.set(value)
+            else:
+                result.set_exception(LoopFinderError(value))
+
+        def analysis_done(value):
+            # called from the pool result thread
+            outcome.append(value)
+            watcher.send()
+
+        watcher.start(deliver)
+        self._pending.add(result)
+        self._pool.apply_async(_find_loop, (data, (width, height), pixels_per_mm_horizontal), callback=analysis_done)
+        return result
+
+    def get(self, result, timeout=None):
+        """Wait for the result of find_loop; workers stuck past the timeout are killed"""
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            return result.get(timeout=timeout)
+        except gevent.Timeout:
+            self.terminate()
+            raise LoopFinderError("Timeout waiting for loop finding, workers terminated")
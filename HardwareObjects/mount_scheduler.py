@@ -0,0 +1,216 @@
+"""
+Scheduling of the sample exchanges done by the queue.
+
+The MountScheduler orders the samples of the queue so that the sample
+changer changes puck as few times as possible and travels as little as
+possible between vials, pre-selects the basket of the next sample while the
+current one is being collected (if the sample changer is configured for it)
+and keeps the duration of every sample exchange.
+
+The cost of going from one location to another is given by the
+mount_cost(from_location, to_location) method of the sample changer if it
+has one, otherwise by a MountCostModel configured with the puck_change_cost
+and vial_travel_cost properties of the sample changer.
+"""
+
+import time
+import logging
+
+
+class MountCostModel(object):
+    """
+    Estimated time, in seconds, to go from one (basket, vial) location
+    to another.
+    """
+    PUCK_CHANGE_COST = 60
+    VIAL_TRAVEL_COST = 1
+
+    def __init__(self, puck_change_cost=PUCK_CHANGE_COST,
+                 vial_travel_cost=VIAL_TRAVEL_COST):
+        self.puck_change_cost = puck_change_cost
+        self.vial_travel_cost = vial_travel_cost
+
+    def __call__(self, from_location, to_location):
+        try:
+            to_basket, to_vial = map(int, to_location)
+        except (TypeError, ValueError):
+            return self.puck_change_cost
+        try:
+            from_basket, from_vial = map(int, from_location)
+        except (TypeError, ValueError):
+            # unknown location (nothing mounted): no preference
+            return 0
+
+        cost = self.vial_travel_cost * abs(to_vial - from_vial)
+        if to_basket != from_basket:
+            cost += self.puck_change_cost
+        return cost
+
+
+def get_mount_cost(sample_changer):
+    """
+    :returns: The mount cost function of <sample_changer>.
+    :rtype: callable
+    """
+    if hasattr(sample_changer, "mount_cost"):
+        return sample_changer.mount_cost
+
+    puck_change_cost = sample_changer.getProperty("puck_change_cost")
+    vial_travel_cost = sample_changer.getProperty("vial_travel_cost")
+    if puck_change_cost is None:
+        puck_change_cost = MountCostModel.PUCK_CHANGE_COST
+    if vial_travel_cost is None:
+        vial_travel_cost = MountCostModel.VIAL_TRAVEL_COST
+    return MountCostModel(float(puck_change_cost), float(vial_travel_cost))
+
+
+def order_locations(locations, current_location=None, mount_cost=None):
+    """
+    Orders <locations> by always going to the cheapest location from the
+    previous one, starting from <current_location>. Locations with the same
+    cost keep their original order.
+
+    :returns: The indices of <locations>, in mounting order.
+    :rtype: list
+    """
+    if mount_cost is None:
+        mount_cost = MountCostModel()
+
+    remaining = range(len(locations))
+    order = []
+    location = current_location
+
+    while remaining:
+        best = min(remaining, key=lambda i: (mount_cost(location, locations[i]), i))
+        remaining.remove(best)
+        order.append(best)
+        location = locations[best]
+
+    return order
+
+
+class MountScheduler(object):
+    PRESELECT_TIMEOUT = 60
+
+    def __init__(self, optimise_order=False):
+        object.__init__(self)
+        self.optimise_order = optimise_order
+        self.sample_changer = None
+        self.exchange_times = []
+        self._samples = []
+        self._preselect_task = None
+
+    def _mountable(self, entry):
+        sample = entry.get_data_model()
+        return entry.is_enabled() and \
+               not getattr(sample, "free_pin_mode", True) and \
+               None not in sample.location
+
+    def schedule(self, entries, sample_changer):
+        """
+        Returns the sample queue entries <entries> in mounting order.
+        Entries that do not need the sample changer keep their place at
+        the end, in their original order.
+
+        :param entries: List of SampleQueueEntry
+        :type entries: list
+
+        :param sample_changer: The sample changer hardware object, or None
+
+        :returns: The ordered entries
+        :rtype: list
+        """
+        self.sample_changer = sample_changer
+        mountable = [entry for entry in entries if self._mountable(entry)]
+        others = [entry for entry in entries if not self._mountable(entry)]
+
+        if self.optimise_order and sample_changer is not None and mountable:
+            locations = [entry.get_data_model().location for entry in mountable]
+            order = order_locations(locations,
+                                    sample_changer.getLoadedSampleLocation(),
+                                    get_mount_cost(sample_changer))
+            mountable = [mountable[i] for i in order]
+            logging.getLogger('queue_exec').info('Sample mounting order: ' + \
+                ', '.join([entry.get_data_model().loc_str for entry in mountable]))
+            entries = mountable + others
+
+        self._samples = [entry.get_data_model() for entry in mountable]
+        return entries
+
+    def clear(self):
+        """
+        Forgets the scheduled samples, so that nothing is pre-selected for
+        entries executed outside of a scheduled queue run.
+        """
+        self._samples = []
+
+    def next_sample(self, sample):
+        """
+        :returns: The sample to be mounted after <sample>, or None.
+        """
+        try:
+            return self._samples[self._samples.index(sample) + 1]
+        except (ValueError, IndexError):
+            return None
+
+    def mount(self, sample, load_function, *args, **kwargs):
+        """
+        Calls load_function(*args, **kwargs) to exchange <sample>, keeping
+        the duration of the exchange. A basket pre-selection still in
+        progress is waited for first.
+        """
+        self.wait_preselect()
+
+        t0 = time.time()
+        result = load_function(*args, **kwargs)
+        exchange_time = time.time() - t0
+        self.exchange_times.append((sample.location, exchange_time))
+
+        mean_time = sum([t for _, t in self.exchange_times]) / len(self.exchange_times)
+        logging.getLogger('queue_exec').info('Sample %s exchanged in %.1f s ' \
+            '(mean over %d exchanges: %.1f s)' % (sample.loc_str, exchange_time,
+                                                  len(self.exchange_times), mean_time))
+        return result
+
+    def preselect_next_basket(self, sample):
+        """
+        Moves the sample changer to the basket of the sample following
+        <sample>, so that it is ready for the next exchange. Only done if
+        the sample changer has the preselect_next_basket property.
+        """
+        sample_changer = self.sample_changer
+        if sample_changer is None or \
+           not sample_changer.getProperty("preselect_next_basket"):
+            return
+
+        if sample not in self._samples:
+            return
+        next_sample = self.next_sample(sample)
+        if next_sample is None or next_sample.location[0] == sample.location[0]:
+            return
+
+        try:
+            logging.getLogger('queue_exec').info('Pre-selecting basket %s' % \
+                                                 next_sample.location[0])
+            self._preselect_task = sample_changer.\
+                changeSelectedBasket(int(next_sample.location[0]), wait=False)
+        except Exception:
+            logging.getLogger('queue_exec').exception('Could not pre-select basket')
+
+    def wait_preselect(self, timeout=PRESELECT_TIMEOUT):
+        """
+        Waits, for at most <timeout> seconds, for the end of the last
+        basket pre-selection.
+        """
+        task = self._preselect_task
+        self._preselect_task = None
+        if task is None:
+            return
+
+        task.join(timeout)
+        if not task.ready():
+            logging.getLogger('queue_exec').warning('Basket pre-selection ' \
+                'still running after %d s' % timeout)
+        elif not task.successful():
+            logging.getLogger('queue_exec').warning('Basket pre-selection ' \
+                'failed: %s' % task.exception)
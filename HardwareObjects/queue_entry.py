@@ -413,11 +413,13 @@ class SampleQueueEntry(BaseQueueEntry):
                 log.info("Loading sample " + self._data_model.loc_str)
                 sample_mounted = self.sample_changer_hwobj.\
                                  is_mounted_sample(self._data_model)
+                mount_scheduler = self.get_queue_controller().mount_scheduler
                 if not sample_mounted:
                     self.sample_centring_result = gevent.event.AsyncResult()
                     try:
                         mount_sample(self.beamline_setup, self._view, self._data_model,
-                                     self.centring_done, self.sample_centring_result)
+                                     self.centring_done, self.sample_centring_result,
+                                     mount_scheduler)
                     except Exception as e:
                         self._view.setText(1, "Error loading")
                         msg = "Error loading sample, please check" +\
@@ -426,6 +428,10 @@ class SampleQueueEntry(BaseQueueEntry):
                         raise QueueExecutionException(e.message, self)
                 else:
                     log.info("Sample already mounted")
+
+                # The robot can get ready for the next sample while this
+                # one is collected
+                mount_scheduler.preselect_next_basket(self._data_model)
             else:
                 msg = "SampleQueuItemPolicy does not have any " +\
                       "sample changer hardware object, cannot " +\
@@ -1057,16 +1063,19 @@ class GenericWorkflowQueueEntry(BaseQueueEntry):
         raise QueueAbortedException('Queue stopped', self)
 
 def mount_sample(beamline_setup_hwobj, view, data_model,
-                 centring_done_cb, async_result):
+                 centring_done_cb, async_result, mount_scheduler=None):
     view.setText(1, "Loading sample")
     beamline_setup_hwobj.shape_history_hwobj.clear_all()
     log = logging.getLogger("user_level_log")
 
     loc = data_model.location
     holder_length = data_model.holder_length
-    beamline_setup_hwobj.sample_changer_hwobj.load_sample(holder_length,
-                                                          sample_location=loc,
-                                                          wait=True)
+    load_sample = beamline_setup_hwobj.sample_changer_hwobj.load_sample
+    if mount_scheduler is not None:
+        mount_scheduler.mount(data_model, load_sample, holder_length,
+                              sample_location=loc, wait=True)
+    else:
+        load_sample(holder_length, sample_location=loc, wait=True)
 
     dm = beamline_setup_hwobj.diffractometer_hwobj
 
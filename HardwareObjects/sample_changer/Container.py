@@ -142,6 +142,19 @@ class Container(Component):
         for c in self.getComponents():
             c._resetDirty()  
 
+    def _getDirtyComponents(self):
+        """
+        Returns the list of components under this container (recursivelly) changed since last reset
+        :rtype: list 
+        """        
+        ret = []
+        for c in self.getComponents():
+            if c._isDirty():
+                ret.append(c)
+                if isinstance(c,Container):
+                    ret.extend(c._getDirtyComponents())
+        return ret
+
     def _setSelectedSample(self,sample):
         for s in self.getSampleList():
             if s==sample:
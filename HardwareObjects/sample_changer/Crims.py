@@ -1,24 +1,284 @@
+"""
+CRIMS client
+
+Requests go through a pool of persistent HTTP(S) connections, using the
+proxies given by the http_proxy/https_proxy environment variables, and
+follow redirections. Responses are kept in an on-disk cache (keyed by barcode/inspection/position for plate
+images, by URL for crystal images) and revalidated with their ETag once
+older than max_age seconds; processing plans are revalidated on every
+request, as they change when the plate is edited in CRIMS. Once a processing plan has been parsed, the
+images of all its crystals are fetched in background threads.
+
+The server addresses are attributes of the client, so that it can be
+pointed to a local server:
+setClient(CrimsClient(image_url=..., plan_url=..., force_https=False)),
+for example to bin/crims-stub-server.
+"""
+import os
 import time
+import errno
+import socket
+import base64
+import hashlib
+import httplib
 import urllib
+import urlparse
+import tempfile
+import threading
+import Queue
+import logging
+
+IMAGE_URL = "https://embl.fr/htxlab/index.php"
+#Crims V3
+PLAN_URL = "https://embl.fr/htxlabj3/index.php"
+
+
+class ConnectionPool:
+    MAX_REDIRECTS = 5
+
+    def __init__(self, max_connections=4, timeout=30):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.proxies = urllib.getproxies()
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _getProxy(self, scheme, netloc):
+        """(netloc, headers) of the proxy to use for netloc, or None"""
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.proxy_bypass(netloc.split(":")[0]):
+            return None
+        if "://" not in proxy:
+            proxy = "http://" + proxy
+        proxy = urlparse.urlsplit(proxy)
+        proxy_netloc = proxy.netloc.rpartition("@")[2]
+        headers = {}
+        if proxy.username is not None:
+            credentials = "%s:%s" % (urllib.unquote(proxy.username), urllib.unquote(proxy.password or ""))
+            headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials)
+        return proxy_netloc, headers
+
+    def _getConnection(self, scheme, netloc):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        proxy = self._getProxy(scheme, netloc)
+        if scheme == "https":
+            if proxy is None:
+                return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+            connection = httplib.HTTPSConnection(proxy[0], timeout=self.timeout)
+            connection.set_tunnel(netloc, headers=proxy[1])
+            return connection, False
+        if proxy is None:
+            return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(proxy[0], timeout=self.timeout), False
+
+    def _releaseConnection(self, scheme, netloc, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_connections:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, url, headers=None):
+        """GET url, following redirections; return (status, headers, body)"""
+        for i in range(self.MAX_REDIRECTS + 1):
+            status, response_headers, body = self._request(url, headers)
+            if status not in (301, 302, 303, 307) or "location" not in response_headers:
+                break
+            url = urlparse.urljoin(url, response_headers["location"])
+        return status, response_headers, body
+
+    def _request(self, url, headers=None):
+        scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+        path = path or "/"
+        if query:
+            path += "?" + query
+        headers = dict(headers or {})
+        if scheme == "http":
+            proxy = self._getProxy(scheme, netloc)
+            if proxy is not None:
+                # plain HTTP proxy: the request line has the absolute URL
+                path = urlparse.urlunsplit((scheme, netloc, path, "", ""))
+                headers.update(proxy[1])
+
+        while True:
+            connection, reused = self._getConnection(scheme, netloc)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if reused:
+                    # closed by the server while idle: try the next one
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._releaseConnection(scheme, netloc, connection)
+            return response.status, dict(response.getheaders()), body
+
+
+class CrimsClient:
+    def __init__(self, cache_dir=None, max_age=600, max_connections=4, timeout=30,
+                 image_url=IMAGE_URL, plan_url=PLAN_URL, force_https=True):
+        if cache_dir is None:
+            cache_dir = os.path.join(tempfile.gettempdir(), "crims_cache")
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.image_url = image_url
+        self.plan_url = plan_url
+        self.force_https = force_https
+        self.pool = ConnectionPool(max_connections, timeout)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._prefetchQueue = Queue.Queue()
+        self._prefetchThreads = []
+
+    def _cachePath(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest() + ".cache")
+
+    def _readCache(self, key):
+        # a cache file is the ETag (possibly empty) on the first line, then the data
+        path = self._cachePath(key)
+        try:
+            f = open(path, "rb")
+            try:
+                etag, data = f.read().split("\n", 1)
+            finally:
+                f.close()
+            age = time.time() - os.path.getmtime(path)
+        except (IOError, OSError, ValueError):
+            return None
+        return data, etag or None, age
+
+    def _writeFile(self, path, data):
+        # readers never see a partially written file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        os.rename(tmp_path, path)
+
+    def _writeCache(self, key, data, etag):
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError, err:
+            if err.errno != errno.EEXIST:
+                raise
+        self._writeFile(self._cachePath(key), "%s\n%s" % (etag or "", data))
+
+    def _fetch(self, key, url, max_age):
+        cached = self._readCache(key)
+        if cached is not None and cached[2] < max_age:
+            return cached[0]
+
+        headers = {}
+        if cached is not None and cached[1]:
+            headers["If-None-Match"] = cached[1]
+        status, response_headers, body = self.pool.request(url, headers)
+
+        if status == 304 and cached is not None:
+            # still valid: restart its max_age
+            try:
+                os.utime(self._cachePath(key), None)
+            except OSError, err:
+                logging.getLogger("HWR").warning("CRIMS: could not update the cache in %s: %s", self.cache_dir, err)
+            return cached[0]
+        if status != 200:
+            raise IOError("CRIMS request failed (HTTP %d): %s" % (status, url))
+        try:
+            self._writeCache(key, body, response_headers.get("etag"))
+        except (IOError, OSError), err:
+            # a cache that cannot be written must not prevent getting the data
+            logging.getLogger("HWR").warning("CRIMS: could not update the cache in %s: %s", self.cache_dir, err)
+        return body
+
+    def fetch(self, key, url, max_age=None):
+        """Content of url, from the cache entry key if it is still valid
+
+        max_age (default: self.max_age) is the age under which the cache
+        entry is used without asking the server; 0 always revalidates it.
+        """
+        if max_age is None:
+            max_age = self.max_age
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = threading.Event()
+        if pending is not None:
+            # already being fetched (by the prefetch threads): use its result
+            pending.wait(self.pool.timeout)
+            cached = self._readCache(key)
+            if cached is not None:
+                return cached[0]
+            return self.fetch(key, url, max_age)
+
+        try:
+            return self._fetch(key, url, max_age)
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+    def fetchURL(self, url):
+        if self.force_https and url.startswith("http://"):
+            url = "https://" + url[7:]
+        return self.fetch("url/" + url, url)
+
+    def getImage(self, barcode, inspection, row, col, shelf):
+        url = "%s?option=com_getbarcodextalinfos&task=getImage&format=raw&barcode=%s&inspection=%d&row=%s&column=%d&shelf=%d" % (self.image_url, barcode, inspection, row, col, shelf)
+        return self.fetch("image/%s/%d/%s%02d-%d" % (barcode, inspection, row, col, shelf), url)
+
+    def getProcessingPlanXML(self, barcode):
+        url = "%s?option=com_getbarcodextalinfos&task=getBarcodeXtalInfos&format=xml&barcode=%s" % (self.plan_url, barcode)
+        return self.fetch("plan/%s" % barcode, url, max_age=0)
+
+    def prefetch(self, urls):
+        """Fetch urls into the cache in background threads"""
+        for url in urls:
+            self._prefetchQueue.put(url)
+        self._prefetchThreads = [t for t in self._prefetchThreads if t.isAlive()]
+        while len(self._prefetchThreads) < min(self.pool.max_connections, self._prefetchQueue.qsize()):
+            thread = threading.Thread(target=self._prefetchWorker)
+            thread.setDaemon(True)
+            thread.start()
+            self._prefetchThreads.append(thread)
+
+    def _prefetchWorker(self):
+        while True:
+            try:
+                url = self._prefetchQueue.get(False)
+            except Queue.Empty:
+                return
+            try:
+                self.fetchURL(url)
+            except:
+                logging.getLogger("HWR").debug("CRIMS: could not prefetch %s", url)
+
+
+_client = None
+
+def getClient():
+    global _client
+    if _client is None:
+        _client = CrimsClient()
+    return _client
+
+def setClient(client):
+    global _client
+    _client = client
 
 
 def getImage(barcode, inspection,row, col, shelf):
-    #print (barcode, inspection,row, col, shelf)
-    url = "https://embl.fr/htxlab/index.php?option=com_getbarcodextalinfos&task=getImage&format=raw&barcode=%s&inspection=%d&row=%s&column=%d&shelf=%d" %  (barcode, inspection,row, col, shelf)    
-    f = urllib.urlopen(url)           
-    img=f.read() 
-    return img
+    return getClient().getImage(barcode, inspection, row, col, shelf)
 
 def getProcessingPlanXML(barcode):
-    #url = "https://embl.fr/htxlab/index.php?option=com_getbarcodextalinfos&task=getBarcodeXtalInfos&barcode=%s" % barcode
-    #Crims V3
-    url = "https://embl.fr/htxlabj3/index.php?option=com_getbarcodextalinfos&task=getBarcodeXtalInfos&format=xml&barcode=%s" % barcode
-    #print "Opening URL: " + url
-    f = urllib.urlopen(url)        
-    #print "Reading: " + barcode
-    xml = f.read()  
-    #print "Received: " + xml
-    return xml
+    return getClient().getProcessingPlanXML(barcode)
 
 
 class Xtal:
@@ -46,13 +306,7 @@ class Xtal:
     def getImage(self):
         if (len(self.IMG_URL)==0):
             return None
-        if (self.IMG_URL.startswith("http://")):
-           self.IMG_URL = "https://" + self.IMG_URL[7];
-        #print "Fetching: " + self.IMG_URL
-        f = urllib.urlopen(self.IMG_URL)           
-        
-        img=f.read() 
-        return img
+        return getClient().fetchURL(self.IMG_URL)
 
     def getSummaryURL(self):
         if (len(self.SUMMARY_URL)==0):
@@ -69,7 +323,7 @@ class ProcessingPlan:
     def __init__(self, *args):
         self.Plate=Plate()
  
-def getProcessingPlan(barcode):
+def getProcessingPlan(barcode, prefetch=True):
     try:    
         sxml = getProcessingPlanXML(barcode)
  
@@ -100,6 +354,8 @@ def getProcessingPlan(barcode):
             xtal.ImageRotation=float(x.find("ImageRotation").text)
             xtal.SUMMARY_URL=x.find("SUMMARY_URL").text
             pp.Plate.Xtal.append(xtal)
+        if prefetch:
+            getClient().prefetch([x.IMG_URL for x in pp.Plate.Xtal if x.IMG_URL])
         return pp
     except:
         return None
@@ -53,6 +53,7 @@ class SampleChanger(Container,Equipment):
     __STATE_CHANGED_EVENT__="stateChanged"
     __STATUS_CHANGED_EVENT__="statusChanged"
     __INFO_CHANGED_EVENT__="infoChanged"
+    __COMPONENTS_CHANGED_EVENT__="componentsChanged"
     __LOADED_SAMPLE_CHANGED_EVENT__="loadedSampleChanged"
     __SELECTION_CHANGED_EVENT__="selectionChanged"    
     __TASK_FINISHED_EVENT__="taskFinished"
@@ -240,6 +241,7 @@ class SampleChanger(Container,Equipment):
         former_loaded = self.getLoadedSample()
         self._doUpdateInfo()        
         if self._isDirty():
+            self._triggerComponentsChangedEvent(self._getDirtyComponents())
             self._triggerInfoChangedEvent()
         
         loaded=self.getLoadedSample()
@@ -515,6 +517,9 @@ class SampleChanger(Container,Equipment):
     def _triggerInfoChangedEvent(self):
         self.emit(self.__INFO_CHANGED_EVENT__, ())    
 
+    def _triggerComponentsChangedEvent(self,components):
+        self.emit(self.__COMPONENTS_CHANGED_EVENT__, (components, ))
+
     def _triggerTaskFinishedEvent(self,task,ret,exception):
         self.emit(self.__TASK_FINISHED_EVENT__, (task, ret, exception))
                 
\ No newline at end of file
@@ -1,5 +1,7 @@
 from GenericSampleChanger import *
 
+import gevent
+from gevent.event import Event
 import xml.sax
 from xml.sax import SAXParseException
 from xml.sax.handler import ContentHandler
@@ -114,6 +116,17 @@ class SC3(SampleChanger):
         self._select_sample = self.addCommand({"type":self.channel_type, "name":self.command_select_sample}, self.command_select_sample)
         self._select_basket = self.addCommand({"type":self.channel_type, "name":self.command_select_basket}, self.command_select_basket)
         self._reset = self.addCommand({"type":self.channel_type, "name":self.command_reset}, self.command_reset)
+
+        self._info_xml = None
+        self._device_state_event = Event()
+        self._info_update_task = None
+        self._info_update_requested = False
+        self._state.connectSignal("update", self._onDeviceStateChanged)
+
+        #Info is updated on device state changes: the timer is just a safety net
+        info_update_interval = self.getProperty("info_update_interval")
+        if info_update_interval is not None:
+            self._setTimerUpdateInterval(int(info_update_interval))
                 
         SampleChanger.init(self)   
             
@@ -123,6 +136,29 @@ class SC3(SampleChanger):
             
         
 
+#########################           EVENTS           #########################
+    def _onDeviceStateChanged(self,state):
+        self._device_state_event.set()
+        if self.isExecutingTask():
+            self._updateState()
+        else:
+            # reading the info blocks: do it out of the channel callback,
+            # once for a burst of state changes
+            self._info_update_requested = True
+            if self._info_update_task is None:
+                self._info_update_task = gevent.spawn(self._infoUpdateTask)
+
+    def _infoUpdateTask(self):
+        try:
+            while self._info_update_requested:
+                self._info_update_requested = False
+                self.updateInfo()
+        except:
+            logging.getLogger("HWR").exception("%s: error updating sample changer info", self.name())
+        finally:
+            self._info_update_task = None
+
+
 #########################           TASKS           #########################
     def _doAbort(self):
         self._abort()            
@@ -131,13 +167,19 @@ class SC3(SampleChanger):
     def _doUpdateInfo(self):       
         try:
             sxml = self._getInfo()
+            if sxml == self._info_xml:
+                #Nothing changed in the baskets and samples since last update
+                self._updateSelection()
+                self._updateState()
+                return
             handler = XMLDataMatrixReadingHandler()        
-            sxml=sxml.replace(' encoding="utf-16"','')
-            xml.sax.parseString(sxml, handler)
+            xml.sax.parseString(sxml.replace(' encoding="utf-16"',''), handler)
             sample_list = handler.dataMatrixList
             basket_list = handler.basketDataMatrixList
+            self._info_xml = sxml
         except Exception,ex:
             logging.error("Error retrieving sample info: %s" % str(ex))
+            self._info_xml = None
             basket_list= [('',4)] * 5
             sample_list=[]
             for b in range(5):
@@ -231,12 +273,10 @@ class SC3(SampleChanger):
         task_id = method(*args)
         ret=None
         if task_id is None: #Reset
-            while self._isDeviceBusy():
-                gevent.sleep(0.1)
+            self._waitDeviceState(lambda: not self._isDeviceBusy())
         else:
-            while self._is_task_running(task_id): #If sync end with task_id must sync start with state        
-            #while self._isDeviceBusy():  
-                gevent.sleep(0.1)            
+            #If sync end with task_id must sync start with state        
+            self._waitDeviceState(lambda: not self._is_task_running(task_id))
             try:
                 ret = self._check_task_result(task_id)                
             except PyTango.DevFailed, traceback:
@@ -275,12 +315,25 @@ class SC3(SampleChanger):
         return state in (PyTango.DevState.STANDBY, PyTango.DevState.MOVING)              
 
     def _waitDeviceReady(self,timeout=-1):
-        start=time.clock()
-        while not self._isDeviceReady():
+        self._waitDeviceState(self._isDeviceReady, timeout)
+
+    def _waitDeviceState(self,condition,timeout=-1):
+        """
+        Waits until condition() is true. It is checked again on each device state change,
+        and every 0.1 s in case an event was missed.
+        """
+        start=time.time()
+        while True:
+            self._device_state_event.clear()
+            if condition():
+                return
+            wait_time=0.1
             if timeout>0:
-                if (time.clock() - start) > timeout:
+                remaining=timeout - (time.time() - start)
+                if remaining <= 0:
                     raise Exception("Timeout waiting device ready")
-            gevent.sleep(0.01)
+                wait_time=min(wait_time, remaining)
+            self._device_state_event.wait(wait_time)
             
     def _updateSelection(self):    
         basket_no = self._selected_basket.getValue()                    
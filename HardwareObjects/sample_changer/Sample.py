@@ -67,10 +67,9 @@ class Sample(Component):
                 img_url = self.getProperty(self.__IMAGE_URL_PROPERTY__)
                 if (len(img_url)==0):
                     return None
-                import urllib
-                f = urllib.urlopen(img_url)                           
-                img=f.read() 
-                return img                
+                # cached, and usually prefetched with the processing plan
+                import Crims
+                return Crims.getClient().fetchURL(img_url)
         except:
             print sys.exc_info()[1]
     
@@ -106,7 +105,7 @@ class Sample(Component):
 
     def _setImageURL(self,value):
         if (value is not None) and (value.startswith("http://")):
-            value = "https://" + value[7];        
+            value = "https://" + value[7:]
         self._setProperty(self.__IMAGE_URL_PROPERTY__,value)
     
     def getImageURL(self):
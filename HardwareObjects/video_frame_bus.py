@@ -0,0 +1,137 @@
+"""
+Latest sample video frames, shared by all the consumers
+
+VideoFrameBus keeps the last frames grabbed from the camera in a ring of
+preallocated numpy arrays, each with a frame id and a timestamp. Consumers
+get read-only views on the frames instead of grabbing and copying their own;
+concurrent requests for a new frame share a single grab. With shared=True
+the ring lives in multiprocessing shared memory, so a forked process can
+read the frames too (see VideoFrameBus.get and is_current).
+"""
+import time
+import ctypes
+import collections
+import multiprocessing.sharedctypes
+import numpy
+import gevent
+import gevent.event
+
+__all__ = ["VideoFrameBus", "Frame"]
+
+Frame = collections.namedtuple("Frame", "id timestamp image")
+
+
+class VideoFrameBus:
+    def __init__(self, grab, width, height, depth=3, slots=4, shared=False):
+        """grab() must return one frame, as a string or an array of width*height*depth bytes"""
+        self._grab = grab
+        self.shape = (height, width, depth)
+        self.slots = slots
+        frame_size = width * height * depth
+
+        if shared:
+            buffer = multiprocessing.sharedctypes.RawArray("B", slots * frame_size)
+            ids = multiprocessing.sharedctypes.RawArray("l", slots)
+            timestamps = multiprocessing.sharedctypes.RawArray("d", slots)
+            self._last_id = multiprocessing.sharedctypes.RawValue("l", 0)
+            self._frames = numpy.frombuffer(buffer, numpy.uint8)
+            self._ids = numpy.frombuffer(ids, numpy.int_)
+            self._timestamps = numpy.frombuffer(timestamps, numpy.float64)
+        else:
+            self._last_id = ctypes.c_long(0)
+            self._frames = numpy.zeros(slots * frame_size, numpy.uint8)
+            self._ids = numpy.zeros(slots, numpy.int_)
+            self._timestamps = numpy.zeros(slots, numpy.float64)
+        self._frames = self._frames.reshape((slots,) + self.shape)
+        self._ids[:] = -1
+
+        self._grab_task = None
+        self._acquisition = None
+        self._new_frame = gevent.event.Event()
+
+    def publish(self, data, timestamp=None):
+        """Copy a frame into the ring, return its id"""
+        frame_id = self._last_id.value + 1
+        slot = frame_id % self.slots
+        # readers check the id of the slot after reading it: mark the slot
+        # as being written, then as holding the new frame
+        self._ids[slot] = -1
+        if isinstance(data, str):
+            data = numpy.frombuffer(data, numpy.uint8)
+        self._frames[slot] = numpy.asarray(data, numpy.uint8).reshape(self.shape)
+        self._timestamps[slot] = timestamp or time.time()
+        self._ids[slot] = frame_id
+        self._last_id.value = frame_id
+
+        new_frame, self._new_frame = self._new_frame, gevent.event.Event()
+        new_frame.set()
+        return frame_id
+
+    def _frame(self, frame_id):
+        slot = frame_id % self.slots
+        image = self._frames[slot]
+        image.flags.writeable = False
+        return Frame(frame_id, self._timestamps[slot], image)
+
+    def latest(self):
+        """Last published frame, or None; the image is a view valid while is_current(frame)"""
+        frame_id = self._last_id.value
+        if frame_id == 0:
+            return None
+        return self._frame(frame_id)
+
+    def get(self, frame_id):
+        """Frame frame_id, or None if it is no longer in the ring"""
+        if frame_id <= 0 or self._ids[frame_id % self.slots] != frame_id:
+            return None
+        return self._frame(frame_id)
+
+    def is_current(self, frame):
+        """False once the slot of frame has been reused for a newer frame"""
+        return self._ids[frame.id % self.slots] == frame.id
+
+    def _do_grab(self):
+        try:
+            return self.publish(self._grab())
+        finally:
+            self._grab_task = None
+
+    def get_frame(self, max_age=None, timeout=None):
+        """A frame not older than max_age seconds (None: any frame), grabbing one if needed"""
+        frame = self.latest()
+        if frame is not None and (max_age is None or time.time() - frame.timestamp <= max_age):
+            return frame
+        return self.next_frame(timeout)
+
+    def next_frame(self, timeout=None):
+        """The first frame grabbed after this call"""
+        if self._acquisition is not None:
+            new_frame = self._new_frame
+            if not new_frame.wait(timeout):
+                raise gevent.Timeout(timeout)
+            return self.latest()
+        task = self._grab_task
+        if task is not None:
+            # the grab in progress started before this call: wait for it,
+            # then share the next grab with the other waiters
+            task.join(timeout)
+            task = self._grab_task
+        if task is None:
+            task = self._grab_task = gevent.spawn(self._do_grab)
+        return self._frame(task.get(timeout=timeout))
+
+    def start_acquisition(self, interval):
+        """Grab frames continuously, for consumers that follow the video"""
+        if self._acquisition is None:
+            self._acquisition = gevent.spawn(self._acquire, interval)
+
+    def stop_acquisition(self):
+        if self._acquisition is not None:
+            self._acquisition.kill()
+            self._acquisition = None
+
+    def _acquire(self, interval):
+        while True:
+            t0 = time.time()
+            self.publish(self._grab())
+            gevent.sleep(max(0, interval - (time.time() - t0)))